@@ -0,0 +1,117 @@
+import logging
+import time
+from threading import Lock
+
+import numpy as np
+from django.core.cache import cache
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+# Ответ переиспользуется, если косинусная близость эмбеддинга нового запроса
+# к сохранённому не ниже порога.
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 60 * 60
+# Номер поколения коллекции документов в Django cache: загрузка документа
+# увеличивает его, и все воркеры, разделяющие backend кэша, сбрасывают свои ответы.
+GENERATION_CACHE_KEY = "answer_cache:generation"
+
+
+class SemanticAnswerCache:
+    """
+    Кэш готовых ответов LLM (текст + подсказки) с поиском по близости эмбеддингов запроса.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, maxsize: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._entries = []
+        self._lock = Lock()
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def _sync_generation(self) -> None:
+        try:
+            generation = await cache.aget(GENERATION_CACHE_KEY, 0)
+        except Exception as e:
+            log.warning(f"Answer cache generation unavailable: {e}")
+            return
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def _evict_expired(self, now: float) -> None:
+        keep = [i for i, entry in enumerate(self._entries) if entry["expires_at"] > now]
+        if len(keep) != len(self._entries):
+            self._entries = [self._entries[i] for i in keep]
+            self._vectors = self._vectors[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+
+    async def lookup(self, query_vector):
+        """
+        Возвращает (answer, suggestions) ближайшего сохранённого запроса или None.
+        """
+        await self._sync_generation()
+        query = self._unit(query_vector)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            if not self._entries:
+                metrics.incr("answer_cache.misses")
+                return None
+            scores = self._vectors @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                metrics.incr("answer_cache.misses")
+                return None
+            entry = self._entries[best]
+        metrics.incr("answer_cache.hits")
+        return entry["answer"], entry["suggestions"]
+
+    async def store(self, query_vector, answer: str, suggestions) -> None:
+        await self._sync_generation()
+        query = self._unit(query_vector)
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            entry = {"answer": answer, "suggestions": suggestions, "expires_at": now + self.ttl}
+            if self._entries:
+                self._vectors = np.vstack([self._vectors, query])
+            else:
+                self._vectors = query.reshape(1, -1)
+            self._entries.append(entry)
+            if len(self._entries) > self.maxsize:
+                overflow = len(self._entries) - self.maxsize
+                self._entries = self._entries[overflow:]
+                self._vectors = self._vectors[overflow:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = []
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    async def invalidate(self) -> None:
+        """
+        Сбрасывает кэш ответов во всех воркерах после изменения коллекции документов.
+        """
+        self.clear()
+        try:
+            try:
+                self.generation = await cache.aincr(GENERATION_CACHE_KEY)
+            except ValueError:
+                await cache.aset(GENERATION_CACHE_KEY, 1, timeout=None)
+                self.generation = 1
+        except Exception as e:
+            log.warning(f"Answer cache generation unavailable: {e}")
+        metrics.incr("answer_cache.invalidations")
+
+
+answer_cache = SemanticAnswerCache()
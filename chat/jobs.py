@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import aio_pika
+from django.utils import timezone
+
+from .answer_cache import answer_cache
+from .models import IngestionJob
+from .qdrant.ingest import IngestStats, sync_document
+from .server_site.send_user_query import RABBITMQ_HOST
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+# Загрузки сохраняются здесь до обработки воркером; папка должна быть общей для
+# веб-воркеров и воркеров индексации.
+UPLOAD_DIR = Path(__file__).resolve().parent.parent / "uploads"
+# "rabbitmq" — задания публикуются в очередь INGEST_QUEUE_NAME;
+# "db" — без брокера, воркер сам забирает задания со статусом queued из базы.
+INGEST_BROKER = "rabbitmq"
+INGEST_QUEUE_NAME = "ingest_task_queue"
+DB_POLL_INTERVAL = 2
+# Как часто воркер сохраняет прогресс задания в базу.
+PROGRESS_INTERVAL = 1.0
+# ————————————————————
+
+_publish_connection = None
+_publish_connection_loop = None
+
+
+def save_upload(uploaded, ext: str) -> str:
+    """
+    Сохраняет загруженный файл в UPLOAD_DIR, не читая его целиком в память.
+    Большие загрузки Django уже записал во временный файл — его достаточно
+    переместить; маленькие, оставшиеся в памяти, пишутся по частям.
+    """
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    path = UPLOAD_DIR / f"{uuid.uuid4()}{ext}"
+    if hasattr(uploaded, "temporary_file_path"):
+        shutil.move(uploaded.temporary_file_path(), path)
+        return str(path)
+    with open(path, "wb") as f:
+        for piece in uploaded.chunks():
+            f.write(piece)
+    return str(path)
+
+
+async def _get_publish_connection():
+    global _publish_connection, _publish_connection_loop
+    loop = asyncio.get_running_loop()
+    if _publish_connection is None or _publish_connection.is_closed or _publish_connection_loop is not loop:
+        _publish_connection = await aio_pika.connect_robust(host=RABBITMQ_HOST)
+        _publish_connection_loop = loop
+    return _publish_connection
+
+
+async def close_publish_connection() -> None:
+    global _publish_connection, _publish_connection_loop
+    if _publish_connection is not None and not _publish_connection.is_closed:
+        await _publish_connection.close()
+    _publish_connection = None
+    _publish_connection_loop = None
+
+
+async def enqueue_job(job: IngestionJob) -> None:
+    """
+    Передаёт задание воркерам индексации. В режиме "db" задание уже в базе,
+    и воркер заберёт его сам.
+    """
+    if INGEST_BROKER != "rabbitmq":
+        return
+    connection = await _get_publish_connection()
+    async with connection.channel() as channel:
+        await channel.declare_queue(INGEST_QUEUE_NAME, durable=True)
+        await channel.default_exchange.publish(
+            aio_pika.Message(
+                body=json.dumps({"job_id": str(job.id)}).encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=INGEST_QUEUE_NAME,
+        )
+
+
+async def create_job(uploaded, source: str, ext: str) -> IngestionJob:
+    path = await asyncio.to_thread(save_upload, uploaded, ext)
+    job = await IngestionJob.objects.acreate(source=source, path=path)
+    try:
+        await enqueue_job(job)
+    except Exception as e:
+        # Файл и запись уже сохранены: задание можно переотправить, а воркер
+        # в режиме "db" подхватит его и так.
+        log.warning(f"Could not publish ingestion job {job.id}: {e}")
+    return job
+
+
+def job_status(job: IngestionJob) -> dict:
+    return {
+        "job_id": str(job.id),
+        "source": job.source,
+        "status": job.status,
+        "pages_parsed": job.pages_parsed,
+        "chunks_embedded": job.chunks_embedded,
+        "points_upserted": job.points_upserted,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+async def _save_progress(job_id, stats: IngestStats, **fields) -> None:
+    await IngestionJob.objects.filter(pk=job_id).aupdate(
+        pages_parsed=stats["extract"].items,
+        chunks_embedded=stats["embed"].items,
+        points_upserted=stats["upsert"].items,
+        **fields,
+    )
+
+
+async def claim_job(job_id) -> bool:
+    """
+    Захват задания — атомарный UPDATE по статусу queued, поэтому одно задание
+    не обработают два воркера.
+    """
+    claimed = await IngestionJob.objects.filter(pk=job_id, status=IngestionJob.STATUS_QUEUED).aupdate(
+        status=IngestionJob.STATUS_RUNNING, started_at=timezone.now(),
+    )
+    return bool(claimed)
+
+
+async def claim_next_job():
+    """
+    Захватывает самое старое задание в очереди; None, если очередь пуста.
+    """
+    while True:
+        job = await IngestionJob.objects.filter(status=IngestionJob.STATUS_QUEUED).order_by("created_at").afirst()
+        if job is None:
+            return None
+        if await claim_job(job.pk):
+            return job.pk
+
+
+async def run_job(job_id) -> bool:
+    """
+    Выполняет задание, если его ещё никто не взял.
+    Возвращает True, если задание было выполнено этим воркером.
+    """
+    if not await claim_job(job_id):
+        return False
+    await process_job(job_id)
+    return True
+
+
+async def process_job(job_id) -> None:
+    """
+    Индексирует уже захваченное задание и сохраняет его прогресс и итог.
+    """
+    job = await IngestionJob.objects.aget(pk=job_id)
+    stats = IngestStats()
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await _save_progress(job.pk, stats)
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await sync_document(job.path, source=job.source, stats=stats)
+    except asyncio.CancelledError:
+        # Воркер останавливается: возвращаем задание в очередь для другого воркера.
+        reporter.cancel()
+        await IngestionJob.objects.filter(pk=job.pk).aupdate(status=IngestionJob.STATUS_QUEUED, started_at=None)
+        raise
+    except Exception as e:
+        log.exception(f"Ingestion job {job.pk} ({job.source}) failed: {e}")
+        status, error = IngestionJob.STATUS_FAILED, str(e)
+    else:
+        status, error = IngestionJob.STATUS_DONE, ""
+        log.info(f"Ingestion job {job.pk} ({job.source}) done: " + "; ".join(stats.report()))
+    finally:
+        reporter.cancel()
+    await _save_progress(job.pk, stats, status=status, error=error, finished_at=timezone.now())
+
+    if status == IngestionJob.STATUS_DONE:
+        await answer_cache.invalidate()
+        try:
+            os.remove(job.path)
+        except OSError as e:
+            log.warning(f"Could not remove upload {job.path}: {e}")
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from django.db import DatabaseError
+
+log = logging.getLogger(__name__)
+
+_background_tasks = set()
+
+
+async def prewarm_caches():
+    """
+    Прогревает кэш эмбеддингов текстами кнопок-подсказок.
+    """
+    from .models import SuggestionButton
+    from .qdrant.search import prewarm_query_cache
+    from .services import INITIAL_SUGGESTIONS
+
+    texts = list(INITIAL_SUGGESTIONS)
+    try:
+        texts += [button.text async for button in SuggestionButton.objects.all()]
+    except DatabaseError as e:
+        log.warning(f"Could not load suggestion buttons for cache pre-warm: {e}")
+    try:
+        await prewarm_query_cache(texts)
+    except Exception as e:
+        log.warning(f"Query cache pre-warm failed: {e}")
+
+
+async def startup():
+    """
+    Инициализация ресурсов ASGI-воркера: общие клиенты создаются один раз на процесс.
+    """
+    from .qdrant.parsing import ensure_collection
+    from .qdrant.search import get_embedding_client, get_qdrant_client
+
+    get_embedding_client()
+    get_qdrant_client()
+    await ensure_collection()
+
+    task = asyncio.get_running_loop().create_task(prewarm_caches())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    log.info("Chat worker resources initialised.")
+
+
+async def shutdown():
+    """
+    Корректное закрытие ресурсов ASGI-воркера.
+    """
+    from .jobs import close_publish_connection
+    from .qdrant.ingest import shutdown_process_pool
+    from .qdrant.search import close_embedding_client, close_qdrant_client
+
+    for task in list(_background_tasks):
+        task.cancel()
+    await close_embedding_client()
+    await close_qdrant_client()
+    shutdown_process_pool()
+    await close_publish_connection()
+    log.info("Chat worker resources closed.")
+
+
+class LifespanMiddleware:
+    """
+    Обрабатывает ASGI lifespan-события, которые Django сам не поддерживает,
+    и передаёт все остальные запросы в приложение Django.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await startup()
+                except Exception as e:
+                    log.exception(f"Startup failed: {e}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await shutdown()
+                except Exception as e:
+                    log.exception(f"Shutdown failed: {e}")
+                    await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.shutdown.complete"})
+                return
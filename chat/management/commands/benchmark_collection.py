@@ -0,0 +1,110 @@
+import asyncio
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from qdrant_client import models
+
+from chat.qdrant.parsing import COLLECTION_NAME, create_collection
+from chat.qdrant.profiles import COLLECTION_PROFILES, exact_search_params, get_profile, search_params
+from chat.qdrant.search import close_qdrant_client, get_qdrant_client
+
+UPSERT_BATCH = 256
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает профили коллекции: копирует точки рабочей коллекции во временные коллекции "
+            "с каждым профилем и измеряет recall@k относительно точного поиска и задержку p50/p99.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default=COLLECTION_NAME, help="Коллекция-источник точек.")
+        parser.add_argument("--profiles", nargs="+", choices=sorted(COLLECTION_PROFILES),
+                            default=sorted(COLLECTION_PROFILES))
+        parser.add_argument("--limit", type=int, default=20000, help="Сколько точек взять из источника.")
+        parser.add_argument("--queries", type=int, default=200,
+                            help="Сколько точек отложить как запросы (в индекс они не попадают).")
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument("--keep", action="store_true", help="Не удалять временные коллекции.")
+
+    def handle(self, *args, **options):
+        async def run():
+            try:
+                await self.benchmark(options)
+            finally:
+                await close_qdrant_client()
+
+        asyncio.run(run())
+
+    async def load_points(self, collection, limit):
+        client = get_qdrant_client()
+        points, offset = [], None
+        while len(points) < limit:
+            batch, offset = await client.scroll(
+                collection_name=collection, limit=min(1024, limit - len(points)), offset=offset,
+                with_payload=False, with_vectors=[""],
+            )
+            for point in batch:
+                vector = point.vector.get("") if isinstance(point.vector, dict) else point.vector
+                points.append((point.id, vector))
+            if offset is None:
+                break
+        return points
+
+    async def build(self, name, profile, points):
+        client = get_qdrant_client()
+        if await client.collection_exists(collection_name=name):
+            await client.delete_collection(collection_name=name)
+        # Порог индексации снижен, чтобы HNSW и квантование строились и на небольшой выборке.
+        await create_collection(name, profile, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1))
+        for start in range(0, len(points), UPSERT_BATCH):
+            await client.upsert(collection_name=name, points=[
+                models.PointStruct(id=point_id, vector={"": vector})
+                for point_id, vector in points[start:start + UPSERT_BATCH]
+            ])
+        started = time.perf_counter()
+        while (await client.get_collection(collection_name=name)).status != models.CollectionStatus.GREEN:
+            await asyncio.sleep(1)
+        return time.perf_counter() - started
+
+    async def run_queries(self, name, queries, k, params):
+        client = get_qdrant_client()
+        results, latencies = [], []
+        for vector in queries:
+            started = time.perf_counter()
+            hits = await client.search(collection_name=name, query_vector=vector, limit=k,
+                                       search_params=params, with_payload=False)
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append([hit.id for hit in hits])
+        return results, np.array(latencies)
+
+    async def benchmark(self, options):
+        k = options["k"]
+        points = await self.load_points(options["collection"], options["limit"] + options["queries"])
+        if len(points) <= options["queries"]:
+            self.stderr.write(f"Not enough points in '{options['collection']}' ({len(points)}).")
+            return
+        random.Random(0).shuffle(points)
+        queries = [vector for _, vector in points[:options["queries"]]]
+        corpus = points[options["queries"]:]
+        self.stdout.write(f"{len(corpus)} points, {len(queries)} queries, k={k}")
+
+        client = get_qdrant_client()
+        truth = None
+        rows = []
+        for profile_name in options["profiles"]:
+            name = f"{options['collection']}_bench_{profile_name}".replace("-", "_")
+            build_time = await self.build(name, profile_name, corpus)
+            if truth is None:
+                truth, _ = await self.run_queries(name, queries, k, exact_search_params())
+            # Прогрев, чтобы первые запросы не портили перцентили.
+            await self.run_queries(name, queries[:10], k, search_params(get_profile(profile_name)))
+            found, latencies = await self.run_queries(name, queries, k, search_params(get_profile(profile_name)))
+            recall = np.mean([len(set(a) & set(t)) / max(1, len(t)) for a, t in zip(found, truth)])
+            rows.append((profile_name, recall, np.percentile(latencies, 50), np.percentile(latencies, 99), build_time))
+            if not options["keep"]:
+                await client.delete_collection(collection_name=name)
+
+        self.stdout.write(f"{'profile':<12}{'recall@' + str(k):>10}{'p50 ms':>10}{'p99 ms':>10}{'index s':>10}")
+        for profile_name, recall, p50, p99, build_time in rows:
+            self.stdout.write(f"{profile_name:<12}{recall:>10.3f}{p50:>10.2f}{p99:>10.2f}{build_time:>10.1f}")
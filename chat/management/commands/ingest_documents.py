@@ -0,0 +1,30 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.qdrant.ingest import DOC_FOLDER, COLLECTION_NAME, ingest_folder, shutdown_process_pool
+from chat.qdrant.parsing import ensure_collection
+from chat.qdrant.search import close_embedding_client, close_qdrant_client
+
+
+class Command(BaseCommand):
+    help = "Загружает документы из папки в текущую коллекцию и печатает пропускную способность стадий."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--folder", default=DOC_FOLDER, help="Папка с документами (PDF, DOCX).")
+        parser.add_argument("--collection", default=COLLECTION_NAME, help="Коллекция или алиас для загрузки.")
+
+    def handle(self, *args, **options):
+        async def run():
+            try:
+                await ensure_collection(options["collection"])
+                return await ingest_folder(options["folder"], collection_name=options["collection"])
+            finally:
+                await close_embedding_client()
+                await close_qdrant_client()
+                shutdown_process_pool()
+
+        stats = asyncio.run(run())
+        for line in stats.report():
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS("Ingestion finished."))
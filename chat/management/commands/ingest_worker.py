@@ -0,0 +1,78 @@
+import asyncio
+import json
+import signal
+
+import aio_pika
+from django.core.management.base import BaseCommand
+
+from chat import jobs
+from chat.qdrant.ingest import shutdown_process_pool
+from chat.qdrant.parsing import ensure_collection
+from chat.qdrant.search import close_embedding_client, close_qdrant_client
+from chat.server_site.send_user_query import RABBITMQ_HOST
+
+
+class Command(BaseCommand):
+    help = "Воркер индексации: обрабатывает задания загрузки документов из очереди."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--broker", choices=["rabbitmq", "db"], default=jobs.INGEST_BROKER,
+                            help="Источник заданий: очередь RabbitMQ или опрос базы.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Сколько заданий обрабатывать одновременно.")
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options["broker"], options["concurrency"]))
+
+    async def run(self, broker, concurrency):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        await ensure_collection()
+        self.stdout.write(f"Ingest worker started (broker={broker}, concurrency={concurrency}).")
+        try:
+            if broker == "rabbitmq":
+                await self.consume_rabbitmq(concurrency, stop)
+            else:
+                await self.poll_db(concurrency, stop)
+        finally:
+            await close_embedding_client()
+            await close_qdrant_client()
+            shutdown_process_pool()
+        self.stdout.write("Ingest worker stopped.")
+
+    async def consume_rabbitmq(self, concurrency, stop):
+        connection = await aio_pika.connect_robust(host=RABBITMQ_HOST)
+        async with connection:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=concurrency)
+            queue = await channel.declare_queue(jobs.INGEST_QUEUE_NAME, durable=True)
+
+            async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+                # Подтверждение после обработки: при падении воркера задание вернётся в очередь.
+                async with message.process(requeue=True):
+                    job_id = json.loads(message.body)["job_id"]
+                    if not await jobs.run_job(job_id):
+                        self.stdout.write(f"Job {job_id} already taken or missing, skipped.")
+
+            tag = await queue.consume(on_message)
+            await stop.wait()
+            await queue.cancel(tag)
+
+    async def poll_db(self, concurrency, stop):
+        running = set()
+        while not stop.is_set():
+            while len(running) < concurrency:
+                job_id = await jobs.claim_next_job()
+                if job_id is None:
+                    break
+                task = asyncio.create_task(jobs.process_job(job_id))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=jobs.DB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        if running:
+            await asyncio.wait(running)
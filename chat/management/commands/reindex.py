@@ -0,0 +1,31 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.qdrant.ingest import DOC_FOLDER, COLLECTION_NAME, reindex, shutdown_process_pool
+from chat.qdrant.profiles import COLLECTION_PROFILE, COLLECTION_PROFILES
+from chat.qdrant.search import close_embedding_client, close_qdrant_client
+
+
+class Command(BaseCommand):
+    help = "Переиндексирует документы в новую версию коллекции и атомарно переключает на неё алиас."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--folder", default=DOC_FOLDER, help="Папка с документами (PDF, DOCX).")
+        parser.add_argument("--alias", default=COLLECTION_NAME, help="Алиас коллекции, используемый поиском.")
+        parser.add_argument("--keep-old", action="store_true", help="Не удалять предыдущую версию коллекции.")
+        parser.add_argument("--profile", choices=sorted(COLLECTION_PROFILES), default=COLLECTION_PROFILE,
+                            help="Профиль хранения векторов и HNSW новой коллекции.")
+
+    def handle(self, *args, **options):
+        async def run():
+            try:
+                return await reindex(folder=options["folder"], alias=options["alias"], keep_old=options["keep_old"],
+                                     profile=options["profile"])
+            finally:
+                await close_embedding_client()
+                await close_qdrant_client()
+                shutdown_process_pool()
+
+        shadow = asyncio.run(run())
+        self.stdout.write(self.style.SUCCESS(f"Reindex finished: '{options['alias']}' -> '{shadow}'."))
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import re
+
+import numpy as np
+from django.core.cache import caches
+
+from . import metrics
+from .qdrant.context import count_llm_tokens
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+# История диалога хранится в Django cache по ключу сессии.
+HISTORY_CACHE_ALIAS = "default"
+HISTORY_KEY_PREFIX = "chat:history:"
+HISTORY_TTL = 24 * 60 * 60
+# Сколько последних реплик держать дословно и сколько токенов LLM отдать истории в промпте.
+HISTORY_MAX_TURNS = 6
+HISTORY_TOKEN_BUDGET = 800
+# После сжатия дословно остаются последние HISTORY_KEEP_RECENT реплик, остальные уходят в сводку.
+HISTORY_KEEP_RECENT = 2
+# Ответ ассистента сохраняется не длиннее этого числа символов.
+HISTORY_ANSWER_CHARS = 2000
+# Уточняющий вопрос переиспользует фрагменты предыдущего ответа без нового поиска.
+FOLLOWUP_SIMILARITY = 0.6
+FOLLOWUP_MAX_WORDS = 6
+# ————————————————————
+
+FOLLOWUP_RE = re.compile(
+    r"^(а|и|но|тогда|ещё|еще|подробнее|почему|зачем|это|этот|эта|эти|там|так|а если|а как|а что|а где|а сколько)\b",
+    re.IGNORECASE,
+)
+
+_background_tasks = set()
+
+
+def _key(session_key: str) -> str:
+    return HISTORY_KEY_PREFIX + session_key
+
+
+def empty_history() -> dict:
+    return {"summary": "", "turns": []}
+
+
+async def load_history(session_key: str) -> dict:
+    """
+    История сессии: {"summary": сводка старых реплик, "turns": [{"user", "assistant", "chunk_ids"}]}.
+    """
+    try:
+        history = await caches[HISTORY_CACHE_ALIAS].aget(_key(session_key))
+    except Exception as e:
+        log.warning(f"Conversation store unavailable: {e}")
+        history = None
+    return history or empty_history()
+
+
+async def save_history(session_key: str, history: dict) -> None:
+    try:
+        await caches[HISTORY_CACHE_ALIAS].aset(_key(session_key), history, timeout=HISTORY_TTL)
+    except Exception as e:
+        log.warning(f"Conversation store unavailable: {e}")
+
+
+async def append_turn(session_key: str, user_msg: str, answer: str, chunk_ids) -> dict:
+    history = await load_history(session_key)
+    history["turns"].append({
+        "user": user_msg,
+        "assistant": answer[:HISTORY_ANSWER_CHARS],
+        "chunk_ids": [str(point_id) for point_id in chunk_ids],
+    })
+    # Страховка на случай, если сжатие не успевает или LLM недоступна.
+    del history["turns"][:-2 * HISTORY_MAX_TURNS]
+    await save_history(session_key, history)
+    return history
+
+
+def _turn_text(turn: dict) -> str:
+    return f"Пользователь: {turn['user']}\nПомощник: {turn['assistant']}"
+
+
+def history_tokens(history: dict) -> int:
+    return count_llm_tokens(history["summary"]) + sum(count_llm_tokens(_turn_text(t)) for t in history["turns"])
+
+
+def needs_compaction(history: dict) -> bool:
+    if len(history["turns"]) <= HISTORY_KEEP_RECENT:
+        return False
+    return len(history["turns"]) > HISTORY_MAX_TURNS or history_tokens(history) > HISTORY_TOKEN_BUDGET
+
+
+def format_history(history: dict, token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Сводка и самые свежие реплики, которые помещаются в token_budget токенов.
+    """
+    parts = []
+    used = 0
+    if history["summary"]:
+        parts.append(f"Краткое содержание предыдущего диалога: {history['summary']}")
+        used += count_llm_tokens(parts[0])
+    recent = []
+    for turn in reversed(history["turns"]):
+        text = _turn_text(turn)
+        tokens = count_llm_tokens(text)
+        if used + tokens > token_budget:
+            break
+        recent.insert(0, text)
+        used += tokens
+    return "\n".join(parts + recent)
+
+
+async def compact_history(session_key: str, summarize) -> None:
+    """
+    Сворачивает старые реплики в сводку. summarize(summary, turns) -> str
+    вызывает LLM; пока она работает, могут прийти новые реплики, поэтому
+    результат применяется к свежей версии истории.
+    """
+    history = await load_history(session_key)
+    if not needs_compaction(history):
+        return
+    old = history["turns"][:-HISTORY_KEEP_RECENT]
+    summary = await summarize(history["summary"], old)
+
+    current = await load_history(session_key)
+    if current["turns"][:len(old)] != old:
+        return
+    current["summary"] = summary
+    current["turns"] = current["turns"][len(old):]
+    await save_history(session_key, current)
+    metrics.incr("memory.compactions")
+
+
+def schedule_compaction(session_key: str, summarize) -> None:
+    async def run():
+        try:
+            await compact_history(session_key, summarize)
+        except Exception as e:
+            log.warning(f"History compaction failed for session {session_key[:8]}: {e}")
+
+    task = asyncio.get_running_loop().create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def is_followup(user_msg: str, query_vector, previous_vector) -> bool:
+    """
+    Уточнение к предыдущему вопросу: близкий по смыслу запрос или короткая
+    реплика, начинающаяся со связки («а если…», «подробнее», «почему»).
+    """
+    if len(user_msg.split()) <= FOLLOWUP_MAX_WORDS and FOLLOWUP_RE.match(user_msg.strip()):
+        return True
+    a = np.asarray(query_vector, dtype=np.float32)
+    b = np.asarray(previous_vector, dtype=np.float32)
+    denominator = float(np.linalg.norm(a) * np.linalg.norm(b)) or 1.0
+    return float(a @ b) / denominator >= FOLLOWUP_SIMILARITY
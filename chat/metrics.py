@@ -0,0 +1,26 @@
+from collections import defaultdict
+from threading import Lock
+
+_counters = defaultdict(float)
+_lock = Lock()
+
+
+def incr(name: str, value: float = 1) -> None:
+    """
+    Увеличивает счётчик метрики процесса.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """
+    Текущие значения всех счётчиков воркера.
+    """
+    with _lock:
+        return dict(sorted(_counters.items()))
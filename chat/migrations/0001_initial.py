@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestionButton',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=100)),
+                ('context', models.CharField(help_text='Контекст, в котором показывается кнопка', max_length=100)),
+                ('order', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['order'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(help_text='Коллекция (алиас) Qdrant', max_length=100)),
+                ('source', models.CharField(help_text='Имя файла-источника', max_length=255)),
+                ('chunk_ids', models.JSONField(default=list, help_text='Id точек фрагментов документа')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('collection', 'source'), name='unique_manifest_source')],
+            },
+        ),
+    ]
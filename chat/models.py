@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
@@ -12,3 +14,49 @@ class SuggestionButton(models.Model):
         
     def __str__(self):
         return self.text
+
+
+class IngestionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Обрабатывается'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source = models.CharField(max_length=255, help_text="Имя загруженного файла")
+    path = models.CharField(max_length=500, help_text="Путь к сохранённой загрузке")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    pages_parsed = models.IntegerField(default=0)
+    chunks_embedded = models.IntegerField(default=0)
+    points_upserted = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.source} ({self.status})"
+
+
+class DocumentManifest(models.Model):
+    collection = models.CharField(max_length=100, help_text="Коллекция (алиас) Qdrant")
+    source = models.CharField(max_length=255, help_text="Имя файла-источника")
+    chunk_ids = models.JSONField(default=list, help_text="Id точек фрагментов документа")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['collection', 'source'], name='unique_manifest_source'),
+        ]
+
+    def __str__(self):
+        return f"{self.collection}/{self.source}"
@@ -0,0 +1,69 @@
+"""
+Сборка сообщений для LLM. Шаблон чата модели применяет воркер
+(server_llm/prompt_template.py); здесь определяется порядок частей:
+неизменный системный промпт, затем документы в детерминированном порядке,
+история и в самом конце — реплика пользователя. Так у запросов с одним
+контекстом (ответ и подсказки, уточняющие вопросы) совпадает длинный
+префикс, и бэкенд переиспользует его KV-кэш.
+"""
+
+# ————— НАСТРОЙКИ —————
+SYSTEM_PROMPT = (
+    "Ты — виртуальный помощник Газпромбанка и отвечаешь на вопросы клиентов по документам банка. "
+    "По умолчанию отвечай про Газпромбанк, если не указаны конкретные источники, "
+    "разделяй ответ на блоки, чтобы удобнее читалось, и используй конкретные цифры "
+    "для описания комиссии и других аспектов."
+)
+# Передавать ключ сессии бэкенду как cache_salt. Выключено: иначе общий для всех
+# пользователей префикс (системный промпт) кэшировался бы отдельно для каждой сессии.
+PROMPT_CACHE_PER_SESSION = False
+# ————————————————————
+
+
+def order_context(hits):
+    """
+    Порядок фрагментов не зависит от их оценок: одинаковый набор документов
+    всегда даёт одинаковый текст контекста.
+    """
+    return sorted(hits, key=lambda hit: (
+        hit.get("source") or "",
+        hit.get("page") if hit.get("page") is not None else -1,
+        str(hit["id"]),
+    ))
+
+
+def format_context(hits) -> str:
+    blocks = []
+    for hit in order_context(hits):
+        label = hit.get("source") or "документ"
+        if hit.get("page") is not None:
+            label += f", стр. {hit['page']}"
+        blocks.append(f"[{label}] " + hit["text"].replace("\n", " ").strip())
+    return "\n".join(blocks)
+
+
+def _context_block(context: str) -> str:
+    return f"Найдены документы по запросу пользователя:\n{context}\n\n"
+
+
+def build_answer_message(context: str, history: str, user_msg: str) -> str:
+    message = _context_block(context)
+    if history:
+        message += f"Предыдущий диалог с пользователем:\n{history}\n\n"
+    return message + f"Пользователь написал:\n{user_msg}"
+
+
+def build_suggestions_message(context: str, user_msg: str) -> str:
+    """
+    Начинается с того же блока документов, что и запрос ответа,
+    поэтому префилл контекста для подсказок берётся из кэша.
+    """
+    return (_context_block(context) +
+            f"Пользователь спросил: {user_msg}\n"
+            "Предложи три вопроса, которые может задать пользователь далее. "
+            "Вопросы отдай строго в json формате, чтобы сработала команда json.load(). "
+            "[{'question': ''}, {'question': ''}, {'question': ''}].")
+
+
+def cache_salt(session_key: str):
+    return session_key if PROMPT_CACHE_PER_SESSION else None
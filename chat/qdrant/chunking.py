@@ -0,0 +1,167 @@
+import logging
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+EMBED_TOKENIZER_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Бюджет чанка в токенах токенизатора эмбеддинг-модели (MiniLM обрезает вход на 256)
+# и перекрытие соседних чанков внутри одной страницы и раздела.
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 40
+# Строка короче этого и без точки в конце может быть заголовком раздела.
+HEADING_MAX_CHARS = 90
+# ————————————————————
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…;])\s+(?=[«\"(\[A-ZА-ЯЁ0-9•\-–—])")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+NUMBERED_HEADING_RE = re.compile(r"^(\d+(\.\d+)*\.?|[IVXLC]+\.)\s+[A-ZА-ЯЁ]")
+NAMED_HEADING_RE = re.compile(r"^(раздел|глава|статья|приложение)\b", re.IGNORECASE)
+
+
+class Chunk(NamedTuple):
+    text: str
+    page: Optional[int]
+    section: Optional[str]
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    Токенизатор эмбеддинг-модели; если transformers недоступен, используется оценка по длине.
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(EMBED_TOKENIZER_NAME)
+    except Exception as e:
+        log.warning(f"Tokenizer {EMBED_TOKENIZER_NAME} unavailable, using length estimate: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return max(1, len(text) // 3)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line[-1] in ".,;:!?":
+        return False
+    if NUMBERED_HEADING_RE.match(line) or NAMED_HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and sum(c.isupper() for c in letters) / len(letters) > 0.8
+
+
+def split_paragraphs(page_text: str) -> List[str]:
+    """
+    Абзацы страницы. PyPDF2 часто не ставит пустых строк, поэтому одиночные
+    переносы внутри предложения склеиваются, а заголовки выделяются в отдельный абзац.
+    """
+    paragraphs = []
+    for block in PARAGRAPH_RE.split(page_text):
+        current = []
+        for line in block.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if is_heading(line):
+                if current:
+                    paragraphs.append(" ".join(current))
+                    current = []
+                paragraphs.append(line)
+                continue
+            current.append(line)
+            if line[-1] in ".!?…:":
+                paragraphs.append(" ".join(current))
+                current = []
+        if current:
+            paragraphs.append(" ".join(current))
+    return paragraphs
+
+
+def split_oversized(sentence: str, max_tokens: int) -> List[str]:
+    """
+    Режет слишком длинное «предложение» (например, строку таблицы) по словам.
+    """
+    pieces, current = [], []
+    for word in sentence.split():
+        candidate = " ".join(current + [word])
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(" ".join(current))
+            current = [word]
+        else:
+            current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def iter_units(paragraph: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    for sentence in SENTENCE_END_RE.split(paragraph):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+        else:
+            for piece in split_oversized(sentence, max_tokens):
+                yield piece, count_tokens(piece)
+
+
+class DocumentChunker:
+    """
+    Потоково разбивает текст по страницам на чанки не длиннее max_tokens токенов.
+    Границы проходят по предложениям; чанк не пересекает границу страницы и раздела,
+    соседние чанки внутри них перекрываются на overlap_tokens. Текущий раздел
+    сохраняется между вызовами chunk_pages, поэтому документ можно подавать частями.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.section: Optional[str] = None
+
+    def chunk_pages(self, pages: Iterable[Tuple[Optional[int], str]]) -> Iterator[Chunk]:
+        for page, page_text in pages:
+            yield from self._chunk_page(page, page_text or "")
+
+    def _chunk_page(self, page: Optional[int], page_text: str) -> Iterator[Chunk]:
+        units: List[Tuple[str, int]] = []
+        size = 0
+
+        def emit():
+            return Chunk(" ".join(text for text, _ in units), page, self.section)
+
+        for paragraph in split_paragraphs(page_text):
+            if is_heading(paragraph):
+                if units:
+                    yield emit()
+                    units, size = [], 0
+                self.section = paragraph
+                continue
+            for text, tokens in iter_units(paragraph, self.max_tokens):
+                if units and size + tokens > self.max_tokens:
+                    yield emit()
+                    overlap, overlap_size = [], 0
+                    for unit in reversed(units):
+                        if (overlap_size + unit[1] > self.overlap_tokens
+                                or overlap_size + unit[1] + tokens > self.max_tokens):
+                            break
+                        overlap.insert(0, unit)
+                        overlap_size += unit[1]
+                    units, size = overlap, overlap_size
+                units.append((text, tokens))
+                size += tokens
+        if units:
+            yield emit()
+
+
+def iter_chunks(pages: Iterable[Tuple[Optional[int], str]], max_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    return DocumentChunker(max_tokens, overlap_tokens).chunk_pages(pages)
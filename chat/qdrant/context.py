@@ -0,0 +1,105 @@
+import logging
+from functools import lru_cache
+
+import numpy as np
+
+from chat import metrics
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+LLM_TOKENIZER_NAME = "t-tech/T-lite-it-1.0"
+# Сколько токенов LLM отводится под найденные документы в промпте.
+CONTEXT_TOKEN_BUDGET = 1500
+# Фрагменты с косинусной близостью выше порога к уже выбранному считаются дубликатами.
+DEDUP_THRESHOLD = 0.95
+# Баланс MMR: 1.0 — только релевантность, 0.0 — только разнообразие.
+MMR_LAMBDA = 0.7
+# ————————————————————
+
+
+@lru_cache(maxsize=1)
+def get_llm_tokenizer():
+    """
+    Токенизатор LLM; если transformers недоступен, используется оценка по длине.
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(LLM_TOKENIZER_NAME)
+    except Exception as e:
+        log.warning(f"Tokenizer {LLM_TOKENIZER_NAME} unavailable, using length estimate: {e}")
+        return None
+
+
+def count_llm_tokens(text: str) -> int:
+    tokenizer = get_llm_tokenizer()
+    if tokenizer is None:
+        return max(1, len(text) // 3)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def build_context(hits, query_vector, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                  mmr_lambda: float = MMR_LAMBDA, dedup_threshold: float = DEDUP_THRESHOLD):
+    """
+    Отбирает фрагменты для промпта из результатов get_relevant_chunks:
+    выкидывает почти-дубликаты по векторам из Qdrant, упорядочивает по MMR
+    и набирает их, пока помещаются в token_budget токенов LLM.
+    Возвращает выбранные фрагменты в порядке отбора.
+    """
+    hits = [hit for hit in hits if hit.get("text")]
+    if not hits:
+        return []
+
+    tokens = [count_llm_tokens(hit["text"]) for hit in hits]
+    total_tokens = sum(tokens)
+
+    # Релевантность — score поиска (косинус или нормированный RRF гибридного поиска),
+    # векторы нужны только для оценки избыточности.
+    relevance = np.array([hit.get("score") or 0.0 for hit in hits], dtype=np.float32)
+    if any(hit.get("vector") is None for hit in hits):
+        similarity = np.eye(len(hits), dtype=np.float32)
+    else:
+        docs = _unit_rows([hit["vector"] for hit in hits])
+        similarity = docs @ docs.T
+        if any(hit.get("score") is None for hit in hits):
+            relevance = docs @ _unit_rows([query_vector])[0]
+
+    selected = []
+    remaining = list(range(len(hits)))
+    used_tokens = 0
+    duplicates = 0
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+
+        keep = []
+        for i, candidate in enumerate(remaining):
+            if redundancy[i] >= dedup_threshold:
+                duplicates += 1
+            elif used_tokens + tokens[candidate] <= token_budget:
+                keep.append(i)
+        if not keep:
+            break
+
+        scores = mmr_lambda * relevance[[remaining[i] for i in keep]] - (1 - mmr_lambda) * redundancy[keep]
+        best = remaining[keep[int(np.argmax(scores))]]
+        selected.append(best)
+        used_tokens += tokens[best]
+        remaining = [remaining[i] for i in keep if remaining[i] != best]
+
+    metrics.incr("context.requests")
+    metrics.incr("context.tokens_used", used_tokens)
+    metrics.incr("context.tokens_saved", total_tokens - used_tokens)
+    metrics.incr("context.duplicates_dropped", duplicates)
+    log.info(f"Context: {len(selected)}/{len(hits)} chunks, {used_tokens} tokens used, "
+             f"{total_tokens - used_tokens} saved, {duplicates} duplicates dropped")
+    return [hits[i] for i in selected]
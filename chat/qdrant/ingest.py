@@ -0,0 +1,383 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from qdrant_client import models
+
+from chat.qdrant.chunking import DocumentChunker
+from chat.qdrant.parsing import (
+    COLLECTION_NAME,
+    DOC_FOLDER,
+    build_points,
+    collection_version,
+    count_pdf_pages,
+    create_collection,
+    extract_pdf_page_range,
+    iter_document_pages,
+    list_documents,
+    point_id,
+    resolve_alias,
+    versioned_collection_name,
+)
+from chat.qdrant.search import collection_has_sparse, encode_async_embeddings, get_qdrant_client
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+# Извлечение текста PDF идёт в пуле процессов кусками по PAGES_PER_TASK страниц.
+EXTRACT_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+PAGES_PER_TASK = 8
+# Эмбеддинги: батчи по EMBED_BATCH_SIZE чанков, не более EMBED_CONCURRENCY запросов одновременно.
+EMBED_BATCH_SIZE = 64
+EMBED_CONCURRENCY = 4
+UPSERT_CONCURRENCY = 2
+# Ёмкость очередей между стадиями: при заполнении предыдущая стадия ждёт (backpressure).
+STAGE_QUEUE_SIZE = 8
+# ————————————————————
+
+_process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Общий пул процессов для разбора PDF. Используется spawn, чтобы не форкать
+    процесс с работающим event loop и потоками.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = None
+
+
+class StageStats:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def record(self, items: int, started: float) -> None:
+        now = time.perf_counter()
+        self.items += items
+        self.busy += now - started
+        self.started = started if self.started is None else min(self.started, started)
+        self.finished = now
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.elapsed if self.elapsed else 0.0
+
+
+class IngestStats:
+    """
+    Счётчики стадий пайплайна: сколько единиц обработано, суммарное время работы
+    и пропускная способность за время активности стадии.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {
+            "extract": StageStats("extract", "pages"),
+            "chunk": StageStats("chunk", "chunks"),
+            "embed": StageStats("embed", "chunks"),
+            "upsert": StageStats("upsert", "points"),
+        }
+        self.documents = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.wall = 0.0
+
+    def __getitem__(self, name: str) -> StageStats:
+        return self.stages[name]
+
+    def report(self) -> List[str]:
+        lines = [
+            f"{self.documents} documents in {self.wall:.1f}s, "
+            f"{self.unchanged} unchanged chunks skipped, {self.deleted} stale points deleted"
+        ]
+        for stage in self.stages.values():
+            lines.append(
+                f"{stage.name:>8}: {stage.items} {stage.unit}, busy {stage.busy:.1f}s, "
+                f"{stage.throughput:.1f} {stage.unit}/s"
+            )
+        return lines
+
+
+async def _run_stages(*coros) -> None:
+    """
+    Запускает стадии конкурентно; если одна падает, остальные отменяются.
+    """
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def ingest_file(path: str, source: Optional[str] = None, collection_name: str = COLLECTION_NAME,
+                      stats: Optional[IngestStats] = None, known_ids: Optional[Set[str]] = None) -> Set[str]:
+    """
+    Загружает документ в Qdrant конвейером из четырёх стадий, связанных
+    ограниченными очередями:
+      extract — страницы PDF разбираются в пуле процессов, по порядку;
+      chunk   — разбиение на чанки в отдельном потоке, раздел переносится между кусками;
+      embed   — до EMBED_CONCURRENCY одновременных запросов к эмбеддинг-серверу;
+      upsert  — запись готовых батчей, параллельно с эмбеддингом следующих.
+    Ни одна CPU-тяжёлая операция не выполняется в event loop.
+
+    known_ids — id точек документа, уже лежащих в коллекции: такие фрагменты
+    не эмбеддятся повторно, а точки, которых больше нет в документе, удаляются.
+    Возвращает id всех точек документа.
+    """
+    source = source or os.path.basename(path)
+    stats = stats or IngestStats()
+    known_ids = known_ids or set()
+    point_ids: Set[str] = set()
+    sparse = await collection_has_sparse(collection_name)
+    client = get_qdrant_client()
+    loop = asyncio.get_running_loop()
+
+    pages_queue: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    batches_queue: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    points_queue: asyncio.Queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+
+    async def extract():
+        if os.path.splitext(path)[1].lower() == ".pdf":
+            pool = get_process_pool()
+            total = await asyncio.to_thread(count_pdf_pages, path)
+            pending = []
+            for start in range(1, total + 1, PAGES_PER_TASK):
+                pending.append((time.perf_counter(), loop.run_in_executor(
+                    pool, extract_pdf_page_range, path, start, start + PAGES_PER_TASK)))
+                # Держим в работе не больше двух заданий на процесс; результаты отдаём по порядку.
+                if len(pending) >= EXTRACT_WORKERS * 2:
+                    started, future = pending.pop(0)
+                    pages = await future
+                    stats["extract"].record(len(pages), started)
+                    await pages_queue.put(pages)
+            for started, future in pending:
+                pages = await future
+                stats["extract"].record(len(pages), started)
+                await pages_queue.put(pages)
+        else:
+            # DOCX и TXT читаются генератором по блокам, в очередь уходит по PAGES_PER_TASK блоков.
+            blocks = iter_document_pages(path)
+            while True:
+                started = time.perf_counter()
+                pages = await asyncio.to_thread(lambda: list(itertools.islice(blocks, PAGES_PER_TASK)))
+                if not pages:
+                    break
+                stats["extract"].record(len(pages), started)
+                await pages_queue.put(pages)
+        await pages_queue.put(None)
+
+    async def chunk():
+        chunker = DocumentChunker()
+        batch = []
+        while (pages := await pages_queue.get()) is not None:
+            started = time.perf_counter()
+            chunks = await asyncio.to_thread(lambda: list(chunker.chunk_pages(pages)))
+            stats["chunk"].record(len(chunks), started)
+            for item in chunks:
+                pid = point_id(source, item.text)
+                if pid in point_ids:
+                    continue
+                point_ids.add(pid)
+                if pid in known_ids:
+                    stats.unchanged += 1
+                    continue
+                batch.append(item)
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    await batches_queue.put(batch)
+                    batch = []
+        if batch:
+            await batches_queue.put(batch)
+        for _ in range(EMBED_CONCURRENCY):
+            await batches_queue.put(None)
+
+    async def embed_worker():
+        while (batch := await batches_queue.get()) is not None:
+            started = time.perf_counter()
+            embeddings = await encode_async_embeddings([item.text for item in batch])
+            stats["embed"].record(len(batch), started)
+            points = await asyncio.to_thread(build_points, batch, embeddings, source, sparse)
+            await points_queue.put(points)
+
+    async def embed():
+        await asyncio.gather(*(embed_worker() for _ in range(EMBED_CONCURRENCY)))
+        for _ in range(UPSERT_CONCURRENCY):
+            await points_queue.put(None)
+
+    async def upsert_worker():
+        while (points := await points_queue.get()) is not None:
+            started = time.perf_counter()
+            await client.upsert(collection_name=collection_name, points=points)
+            stats["upsert"].record(len(points), started)
+
+    started = time.perf_counter()
+    await _run_stages(extract(), chunk(), embed(), *(upsert_worker() for _ in range(UPSERT_CONCURRENCY)))
+
+    stale = known_ids - point_ids
+    if stale:
+        await client.delete(collection_name=collection_name,
+                            points_selector=models.PointIdsList(points=list(stale)))
+        stats.deleted += len(stale)
+    stats.documents += 1
+    stats.wall += time.perf_counter() - started
+    return point_ids
+
+
+async def fetch_source_ids(source: str, collection_name: str = COLLECTION_NAME) -> Set[str]:
+    """
+    Id всех точек документа в коллекции — для документов без манифеста.
+    """
+    client = get_qdrant_client()
+    source_filter = models.Filter(must=[
+        models.FieldCondition(key="source", match=models.MatchValue(value=source)),
+    ])
+    ids, offset = set(), None
+    while True:
+        points, offset = await client.scroll(
+            collection_name=collection_name,
+            scroll_filter=source_filter,
+            limit=1024,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.update(str(point.id) for point in points)
+        if offset is None:
+            return ids
+
+
+async def load_manifest(source: str, collection_name: str = COLLECTION_NAME) -> Optional[Set[str]]:
+    from chat.models import DocumentManifest
+
+    manifest = await DocumentManifest.objects.filter(collection=collection_name, source=source).afirst()
+    return set(manifest.chunk_ids) if manifest is not None else None
+
+
+async def save_manifest(source: str, point_ids: Set[str], collection_name: str = COLLECTION_NAME) -> None:
+    from chat.models import DocumentManifest
+
+    await DocumentManifest.objects.aupdate_or_create(
+        collection=collection_name, source=source, defaults={"chunk_ids": sorted(point_ids)},
+    )
+
+
+async def sync_document(path: str, source: Optional[str] = None, collection_name: str = COLLECTION_NAME,
+                        stats: Optional[IngestStats] = None) -> Set[str]:
+    """
+    Инкрементальная загрузка документа: эмбеддятся и записываются только новые
+    фрагменты, удаляются только исчезнувшие. Прошлый состав документа берётся
+    из манифеста, а если его нет — из самой коллекции по полю source.
+    """
+    source = source or os.path.basename(path)
+    known_ids = await load_manifest(source, collection_name)
+    if known_ids is None:
+        known_ids = await fetch_source_ids(source, collection_name)
+    point_ids = await ingest_file(path, source=source, collection_name=collection_name,
+                                  stats=stats, known_ids=known_ids)
+    await save_manifest(source, point_ids, collection_name)
+    return point_ids
+
+
+async def upload_document_to_qdrant(path: str, collection_name: str = COLLECTION_NAME) -> None:
+    """
+    Полная обработка одного документа: парсинг, чанкирование,
+    получение эмбеддингов и загрузка в коллекцию Qdrant.
+    """
+    await sync_document(path, collection_name=collection_name)
+
+
+async def ingest_folder(folder: str = DOC_FOLDER, collection_name: str = COLLECTION_NAME) -> IngestStats:
+    """
+    Инкрементально загружает все документы папки. Файлы идут по очереди,
+    параллелизм — внутри пайплайна.
+    """
+    stats = IngestStats()
+    for path in list_documents(folder):
+        print(f"Indexing {os.path.basename(path)}...")
+        await sync_document(path, collection_name=collection_name, stats=stats)
+    return stats
+
+
+async def reindex(folder: str = DOC_FOLDER, alias: str = COLLECTION_NAME, keep_old: bool = False,
+                  profile: Optional[str] = None) -> str:
+    """
+    Полная переиндексация без окна с пустым индексом: документы загружаются
+    в новую теневую коллекцию <alias>_v<N+1> (с параметрами профиля profile),
+    после чего алиас атомарно переключается на неё. Возвращает имя новой коллекции.
+    """
+    client = get_qdrant_client()
+    current = await resolve_alias(alias)
+    legacy = current is None and await client.collection_exists(collection_name=alias)
+    existing = [c.name for c in (await client.get_collections()).collections]
+    versions = [v for v in (collection_version(name, alias) for name in existing) if v is not None]
+    shadow = versioned_collection_name(max(versions, default=0) + 1, alias)
+
+    print(f"Building shadow collection '{shadow}' from {folder}...")
+    await create_collection(shadow, profile)
+    stats = IngestStats()
+    documents = {}
+    try:
+        for path in list_documents(folder):
+            source = os.path.basename(path)
+            print(f"Indexing {source}...")
+            documents[source] = await ingest_file(path, source=source, collection_name=shadow, stats=stats)
+    except Exception:
+        await client.delete_collection(collection_name=shadow)
+        raise
+    for line in stats.report():
+        print(line)
+
+    if legacy:
+        # Алиас не может совпадать с именем существующей коллекции, поэтому
+        # старую коллекцию приходится удалить до переключения.
+        print(f"Dropping legacy collection '{alias}' to replace it with an alias.")
+        await client.delete_collection(collection_name=alias)
+
+    operations = []
+    if current is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=shadow, alias_name=alias)))
+    await client.update_collection_aliases(change_aliases_operations=operations)
+    print(f"Alias '{alias}' now points to '{shadow}'.")
+
+    # Манифесты описывают содержимое коллекции за алиасом, поэтому переписываются целиком.
+    from chat.models import DocumentManifest
+    await DocumentManifest.objects.filter(collection=alias).exclude(source__in=list(documents)).adelete()
+    for source, point_ids in documents.items():
+        await save_manifest(source, point_ids, alias)
+
+    if current is not None and not keep_old:
+        await client.delete_collection(collection_name=current)
+        print(f"Dropped previous collection '{current}'.")
+    return shadow
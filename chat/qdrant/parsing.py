@@ -1,49 +1,228 @@
 import os
 import uuid
-from typing import List
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Tuple
 from PyPDF2 import PdfReader
 from docx import Document
-from qdrant_client import QdrantClient, models
+from qdrant_client import models
 
-from chat.qdrant.search import encode_async_embeddings
+from chat.qdrant.chunking import Chunk, iter_chunks
+from chat.qdrant.profiles import get_profile, hnsw_config, quantization_config
+from chat.qdrant.search import collection_has_sparse, encode_async_embeddings, get_qdrant_client
+from chat.qdrant.sparse import SPARSE_VECTOR_NAME, document_sparse_vector
 
 # ————— НАСТРОЙКИ —————
-QDRANT_HOST = "195.161.62.198"
-QDRANT_REST_PORT = 6334
 COLLECTION_NAME = "pdf_documents"
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-CHUNK_SIZE = 200
+EMBED_DIM = 384
+EMBED_DISTANCE = models.Distance.COSINE
 BATCH_SIZE = 256
-DOC_FOLDER = "documents"
+# DOCX и TXT не делятся на страницы; текст отдаётся блоками примерно такого размера.
+TEXT_BLOCK_CHARS = 64 * 1024
+DOC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "documents")
 # ————————————————————
 
-client = QdrantClient(
-    url=f"http://{QDRANT_HOST}:{QDRANT_REST_PORT}",
-    prefer_grpc=False,
-    timeout=30
-)
-
-if client.collection_exists(collection_name=COLLECTION_NAME):
-    client.delete_collection(collection_name=COLLECTION_NAME)
-client.create_collection(
-    collection_name=COLLECTION_NAME,
-    vectors_config=models.VectorParams(
-        size=384,
-        distance=models.Distance.COSINE
+# Пространство имён для детерминированных id точек: один и тот же фрагмент
+# одного и того же документа всегда попадает в одну и ту же точку.
+POINT_ID_NAMESPACE = uuid.UUID("5f0f3c1e-8d7a-4a53-9a57-2f1f6c0b9e41")
+
+def versioned_collection_name(version: int, alias: str = COLLECTION_NAME) -> str:
+    return f"{alias}_v{version}"
+
+
+def collection_version(name: str, alias: str = COLLECTION_NAME):
+    """
+    Номер версии физической коллекции вида <alias>_v<N> или None.
+    """
+    prefix = f"{alias}_v"
+    if name.startswith(prefix) and name[len(prefix):].isdigit():
+        return int(name[len(prefix):])
+    return None
+
+
+async def resolve_alias(alias: str = COLLECTION_NAME):
+    """
+    Имя физической коллекции, на которую указывает алиас, или None.
+    """
+    client = get_qdrant_client()
+    for description in (await client.get_aliases()).aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+async def create_collection(name: str, profile: Optional[str] = None,
+                            optimizers_config: Optional[models.OptimizersConfigDiff] = None) -> None:
+    """
+    Создаёт коллекцию с параметрами хранения и HNSW из профиля (см. profiles.py).
+    """
+    client = get_qdrant_client()
+    params = get_profile(profile)
+    await client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(
+            size=EMBED_DIM,
+            distance=EMBED_DISTANCE,
+            on_disk=params.on_disk or None,
+        ),
+        sparse_vectors_config={
+            SPARSE_VECTOR_NAME: models.SparseVectorParams(),
+        },
+        hnsw_config=hnsw_config(params),
+        quantization_config=quantization_config(params),
+        optimizers_config=optimizers_config,
     )
-)
+    # Индекс по источнику: выборка и удаление точек документа при повторной загрузке.
+    await client.create_payload_index(
+        collection_name=name,
+        field_name="source",
+        field_schema=models.PayloadSchemaType.KEYWORD,
+    )
+
+
+async def validate_collection(name: str) -> None:
+    """
+    Проверяет, что размерность и метрика коллекции совпадают с настроенной моделью.
+    """
+    params = (await get_qdrant_client().get_collection(collection_name=name)).config.params.vectors
+    if not isinstance(params, models.VectorParams):
+        raise RuntimeError(f"Collection '{name}' uses named vectors, expected a single unnamed vector.")
+    if params.size != EMBED_DIM or params.distance != EMBED_DISTANCE:
+        raise RuntimeError(
+            f"Collection '{name}' has size={params.size}, distance={params.distance}; "
+            f"model {EMBED_MODEL_NAME} needs size={EMBED_DIM}, distance={EMBED_DISTANCE}. "
+            f"Run 'python manage.py reindex' to rebuild it."
+        )
+    if not await collection_has_sparse(name):
+        print(f"Collection '{name}' has no '{SPARSE_VECTOR_NAME}' sparse vectors: keyword search is disabled "
+              f"until 'python manage.py reindex' rebuilds it.")
+
+
+async def ensure_collection(alias: str = COLLECTION_NAME) -> str:
+    """
+    Идемпотентная инициализация коллекции: ничего не удаляет, создаёт
+    <alias>_v1 с алиасом <alias> только если коллекции ещё нет, и проверяет
+    параметры векторов существующей. Возвращает имя физической коллекции.
+    """
+    client = get_qdrant_client()
+    target = await resolve_alias(alias)
+    if target is None and await client.collection_exists(collection_name=alias):
+        # Коллекция, созданная до перехода на алиасы.
+        target = alias
+    if target is None:
+        target = versioned_collection_name(1, alias)
+        if not await client.collection_exists(collection_name=target):
+            await create_collection(target)
+        await client.update_collection_aliases(change_aliases_operations=[
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=alias))
+        ])
+        print(f"Created collection '{target}' with alias '{alias}'.")
+    await validate_collection(target)
+    return target
+
+
+@contextmanager
+def open_pdf(path):
+    """
+    PdfReader, получив путь, читает весь файл в память; с открытым файлом
+    он читает только нужные объекты по смещениям.
+    """
+    if not isinstance(path, (str, os.PathLike)):
+        yield PdfReader(path)
+        return
+    with open(path, "rb") as f:
+        yield PdfReader(f)
+
+
+def iter_pdf_pages(path) -> Iterator[Tuple[int, str]]:
+    """
+    Постранично извлекает текст из PDF: (номер страницы с 1, текст).
+    """
+    with open_pdf(path) as reader:
+        for number, page in enumerate(reader.pages, start=1):
+            yield number, page.extract_text() or ""
+
+
+def count_pdf_pages(path) -> int:
+    with open_pdf(path) as reader:
+        return len(reader.pages)
+
+
+def extract_pdf_page_range(path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    Текст страниц PDF с номерами [start, stop) (с 1). Выполняется в пуле процессов,
+    поэтому принимает путь, а не открытый файл.
+    """
+    with open_pdf(path) as reader:
+        stop = min(stop, len(reader.pages) + 1)
+        return [(number, reader.pages[number - 1].extract_text() or "") for number in range(start, stop)]
+
+
+def iter_text_blocks(paragraphs: Iterable[str], block_chars: int = TEXT_BLOCK_CHARS) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Склеивает абзацы в блоки не длиннее block_chars символов (абзац не разрезается).
+    """
+    block, size = [], 0
+    for paragraph in paragraphs:
+        if block and size + len(paragraph) > block_chars:
+            yield None, "\n\n".join(block)
+            block, size = [], 0
+        block.append(paragraph)
+        size += len(paragraph) + 2
+    if block:
+        yield None, "\n\n".join(block)
+
+
+def iter_docx_pages(path) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    DOCX не хранит разбиение на страницы, поэтому текст отдаётся блоками абзацев.
+    """
+    doc = Document(path)
+    yield from iter_text_blocks(p.text for p in doc.paragraphs)
+
+
+def iter_text_pages(path, block_chars: int = TEXT_BLOCK_CHARS) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Текстовый файл читается и декодируется блоками по block_chars символов;
+    блок обрезается по последней границе абзаца (или строки), остаток
+    переносится в следующий.
+    """
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        tail = ""
+        while True:
+            data = f.read(block_chars)
+            if not data:
+                break
+            text = tail + data
+            cut = text.rfind("\n\n")
+            if cut <= 0:
+                cut = text.rfind("\n")
+            if cut <= 0:
+                tail = ""
+                yield None, text
+                continue
+            tail = text[cut:]
+            yield None, text[:cut]
+        if tail.strip():
+            yield None, tail
+
+
+def iter_document_pages(path: str) -> Iterator[Tuple[Optional[int], str]]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        return iter_pdf_pages(path)
+    if ext == ".docx":
+        return iter_docx_pages(path)
+    if ext == ".txt":
+        return iter_text_pages(path)
+    raise ValueError(f"Unsupported file type: {ext}")
 
 
 def extract_text_from_pdf(path: str) -> str:
     """
     Извлекает текст из PDF-файла.
     """
-    reader = PdfReader(path)
-    pages = []
-    for page in reader.pages:
-        txt = page.extract_text() or ""
-        pages.append(txt)
-    return "\n".join(pages)
+    return "\n".join(text for _, text in iter_pdf_pages(path))
 
 
 def extract_text_from_docx(path: str) -> str:
@@ -67,37 +246,76 @@ def extract_text(path: str) -> str:
     raise ValueError(f"Unsupported file type: {ext}")
 
 
-def chunk_text(text: str, size: int = CHUNK_SIZE) -> List[str]:
+def chunk_text(text: str) -> List[str]:
+    """
+    Разбивает текст на чанки по предложениям в пределах бюджета токенов.
+    """
+    return [chunk.text for chunk in iter_chunks([(None, text)])]
+
+
+def point_id(source: str, text: str) -> str:
     """
-    Разбивает текст на чанки по размеру.
+    Id точки — хеш содержимого (источник, текст фрагмента), поэтому повторная
+    загрузка того же документа перезаписывает точки, а не дублирует их.
     """
-    return [text[i:i + size].strip() for i in range(0, len(text), size) if text[i:i + size].strip()]
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{source}\0{text}"))
 
 
-async def upload_document_to_qdrant(path: str) -> None:
+def build_points(chunks: List[Chunk], embeddings, source: str, sparse: bool = True) -> List[models.PointStruct]:
     """
-    Полная обработка одного документа: парсинг, чанкирование,
-    получение эмбеддингов и загрузка в коллекцию Qdrant.
+    Точки для upsert: плотный вектор без имени и, если коллекция их поддерживает,
+    разреженный BM25-вектор SPARSE_VECTOR_NAME.
     """
-    text = extract_text(path)
-    chunks = chunk_text(text)
-    embeddings = await encode_async_embeddings(chunks)
+    return [
+        models.PointStruct(
+            id=point_id(source, chunk.text),
+            vector=(
+                {"": emb.tolist(), SPARSE_VECTOR_NAME: document_sparse_vector(chunk.text)}
+                if sparse else emb.tolist()
+            ),
+            payload={"text": chunk.text, "source": source, "page": chunk.page, "section": chunk.section},
+        )
+        for chunk, emb in zip(chunks, embeddings)
+    ]
 
-    points: List[models.PointStruct] = []
-    source = os.path.basename(path)
-    for chunk, emb in zip(chunks, embeddings):
-        points.append(models.PointStruct(id=str(uuid.uuid4()), vector=emb, payload={"text": chunk, "source": source}))
-        if len(points) >= BATCH_SIZE:
-            client.upsert(collection_name=COLLECTION_NAME, points=points)
-            points.clear()
-    if points:
-        client.upsert(collection_name=COLLECTION_NAME, points=points)
 
+async def upload_chunks(chunks: Iterable[Chunk], source: str, collection_name: str = COLLECTION_NAME) -> int:
+    """
+    Эмбеддинги и загрузка чанков батчами по BATCH_SIZE по мере их поступления.
+    Возвращает число загруженных точек.
+    """
+    client = get_qdrant_client()
+    sparse = await collection_has_sparse(collection_name)
+    total = 0
+
+    async def flush(batch: List[Chunk]):
+        embeddings = await encode_async_embeddings([chunk.text for chunk in batch])
+        points = build_points(batch, embeddings, source, sparse)
+        await client.upsert(collection_name=collection_name, points=points)
+        return len(points)
+
+    batch: List[Chunk] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= BATCH_SIZE:
+            total += await flush(batch)
+            batch = []
+    if batch:
+        total += await flush(batch)
+    return total
 
-def get_collection_stats() -> int:
+
+async def get_collection_stats() -> int:
     """
     Проверка заполненности коллекции: возвращает общее число точек.
     """
-    stats = client.count(collection_name=COLLECTION_NAME)
+    stats = await get_qdrant_client().count(collection_name=COLLECTION_NAME)
     print(f"Total points in '{COLLECTION_NAME}': {stats.count}")
     return stats.count
+
+
+def list_documents(folder: str = DOC_FOLDER) -> List[str]:
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if os.path.splitext(name)[1].lower() in (".pdf", ".docx")
+    )
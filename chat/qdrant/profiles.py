@@ -0,0 +1,78 @@
+from typing import NamedTuple, Optional
+
+from qdrant_client import models
+
+
+class CollectionProfile(NamedTuple):
+    """
+    Параметры хранения и поиска плотных векторов коллекции.
+      quantization: None, "int8" (scalar) или "binary"; оригинальные векторы
+                    остаются для rescore, квантованные держатся в RAM;
+      on_disk:      оригинальные float32-векторы хранятся на диске (mmap);
+      hnsw_m, ef_construct: параметры построения графа HNSW (None — по умолчанию Qdrant);
+      hnsw_ef:      ширина поиска по графу;
+      oversampling: во сколько раз больше кандидатов брать из квантованного индекса перед rescore.
+    """
+    quantization: Optional[str] = None
+    on_disk: bool = False
+    hnsw_m: Optional[int] = None
+    ef_construct: Optional[int] = None
+    hnsw_ef: Optional[int] = None
+    oversampling: Optional[float] = None
+
+
+# ————— НАСТРОЙКИ —————
+COLLECTION_PROFILES = {
+    # float32 в RAM, HNSW по умолчанию — как было до профилей.
+    "default": CollectionProfile(),
+    # int8: в 4 раза меньше RAM под векторы, точность почти без потерь после rescore.
+    "int8": CollectionProfile(quantization="int8", hnsw_m=16, ef_construct=128, hnsw_ef=96, oversampling=2.0),
+    # int8 в RAM, оригиналы на диске: для корпуса, который не помещается в память.
+    "int8-disk": CollectionProfile(quantization="int8", on_disk=True, hnsw_m=16, ef_construct=128,
+                                   hnsw_ef=96, oversampling=2.0),
+    # binary: в 32 раза меньше RAM; для 384-мерной MiniLM нужен большой oversampling.
+    "binary": CollectionProfile(quantization="binary", on_disk=True, hnsw_m=32, ef_construct=256,
+                                hnsw_ef=128, oversampling=4.0),
+}
+# Профиль, с которым создаются новые коллекции и выполняется поиск.
+COLLECTION_PROFILE = "default"
+# ————————————————————
+
+
+def get_profile(name: Optional[str] = None) -> CollectionProfile:
+    name = name or COLLECTION_PROFILE
+    if name not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown collection profile '{name}', expected one of {sorted(COLLECTION_PROFILES)}.")
+    return COLLECTION_PROFILES[name]
+
+
+def hnsw_config(profile: CollectionProfile) -> Optional[models.HnswConfigDiff]:
+    if profile.hnsw_m is None and profile.ef_construct is None:
+        return None
+    return models.HnswConfigDiff(m=profile.hnsw_m, ef_construct=profile.ef_construct)
+
+
+def quantization_config(profile: CollectionProfile):
+    if profile.quantization == "int8":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True,
+        ))
+    if profile.quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def search_params(profile: CollectionProfile) -> Optional[models.SearchParams]:
+    if profile.hnsw_ef is None and profile.quantization is None:
+        return None
+    quantization = None
+    if profile.quantization is not None:
+        quantization = models.QuantizationSearchParams(rescore=True, oversampling=profile.oversampling)
+    return models.SearchParams(hnsw_ef=profile.hnsw_ef, quantization=quantization)
+
+
+def exact_search_params() -> models.SearchParams:
+    """
+    Полный перебор по оригинальным векторам — эталон для оценки recall.
+    """
+    return models.SearchParams(exact=True, quantization=models.QuantizationSearchParams(ignore=True))
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+
+from chat import metrics
+from chat.qdrant.search import get_embedding_client
+
+log = logging.getLogger(__name__)
+
+# ————— НАСТРОЙКИ —————
+RERANK_URL = "http://localhost:8800/rerank"
+RERANK_ENABLED = True
+# Сколько лучших фрагментов оставить после переранжирования.
+RERANK_TOP_N = 5
+# Бюджет на переранжирование: если cross-encoder не уложился, берётся исходный порядок поиска.
+RERANK_TIMEOUT = 0.3
+# ————————————————————
+
+
+async def _rerank_request(query: str, passages, top_n: int):
+    response = await get_embedding_client().post(
+        RERANK_URL, json={"query": query, "passages": passages, "top_n": top_n},
+    )
+    response.raise_for_status()
+    return response.json()["results"]
+
+
+async def rerank_chunks(query: str, hits, top_n: int = RERANK_TOP_N, timeout: float = RERANK_TIMEOUT):
+    """
+    Переупорядочивает результаты get_relevant_chunks cross-encoder'ом эмбеддинг-сервера
+    и оставляет top_n лучших; score фрагмента заменяется оценкой cross-encoder'а.
+    При ошибке или превышении бюджета возвращает первые top_n в исходном порядке.
+    """
+    if not RERANK_ENABLED or len(hits) <= 1:
+        return hits[:top_n]
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(
+            _rerank_request(query, [hit["text"] for hit in hits], top_n), timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        metrics.incr("rerank.timeouts")
+        log.warning(f"Rerank exceeded {timeout * 1000:.0f} ms budget, using search order.")
+        return hits[:top_n]
+    except Exception as e:
+        metrics.incr("rerank.errors")
+        log.warning(f"Rerank failed, using search order: {e}")
+        return hits[:top_n]
+
+    metrics.incr("rerank.requests")
+    metrics.incr("rerank.latency_ms", int((time.perf_counter() - started) * 1000))
+    return [dict(hits[result["index"]], score=result["score"]) for result in results]
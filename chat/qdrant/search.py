@@ -1,50 +1,335 @@
+import asyncio
+import hashlib
+import logging
+import struct
+
 import httpx
 import numpy as np
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, models
+
+from chat import metrics
+from chat.qdrant.cache import TTLCache
+from chat.qdrant.profiles import get_profile, search_params
+from chat.qdrant.sparse import SPARSE_VECTOR_NAME, query_sparse_vector
+
+log = logging.getLogger(__name__)
 
 # ————— НАСТРОЙКИ —————
 QDRANT_HOST = "195.161.62.198"
 QDRANT_REST_PORT = 6334
+QDRANT_GRPC_PORT = 6335
+QDRANT_PREFER_GRPC = False
+QDRANT_TIMEOUT = 30
+QDRANT_POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
 COLLECTION_NAME = "pdf_documents"
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+# Гибридный поиск: плотный и BM25-поиск идут параллельно и сливаются
+# reciprocal rank fusion: score = sum(1 / (RRF_K + rank)).
+HYBRID_SEARCH = True
+RRF_K = 60
 # ————————————————————
 
 API_URL = "http://localhost:8800/embed"
 
+# Бинарный ответ эмбеддинг-сервера (см. embedding_server/emb_server.py):
+# uint32 LE число векторов, uint32 LE размерность, затем float32 LE по строкам.
+EMBED_BINARY_MEDIA_TYPE = "application/x-embeddings-f32"
+EMBED_BINARY_HEADER = struct.Struct("<II")
+EMBED_ACCEPT = f"{EMBED_BINARY_MEDIA_TYPE}, application/json;q=0.5"
+
+# Пул соединений к эмбеддинг-серверу: один клиент на ASGI-воркер.
+# HTTP/2 поверх plain http требует h2c на стороне сервера, поэтому по умолчанию выключен.
+EMBED_HTTP2 = False
+EMBED_POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+EMBED_TIMEOUT = httpx.Timeout(30.0, connect=5.0, pool=10.0)
+
+_embed_client = None
+_embed_client_loop = None
+
+# Кэш эмбеддингов запросов: локальный LRU+TTL в каждом воркере и, опционально,
+# общий backend Django cache (например, Redis), чтобы воркеры Gunicorn делили попадания.
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 6 * 60 * 60
+QUERY_CACHE_SHARED_ALIAS = None
+QUERY_CACHE_KEY_PREFIX = "qemb:"
+
+query_embedding_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+
+def decode_embeddings(response: httpx.Response) -> np.ndarray:
+    """
+    Разбирает ответ /embed: бинарный float32 без копирования через np.frombuffer,
+    либо JSON для старых версий сервера.
+    """
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith(EMBED_BINARY_MEDIA_TYPE):
+        body = response.content
+        rows, dim = EMBED_BINARY_HEADER.unpack_from(body)
+        matrix = np.frombuffer(body, dtype="<f4", count=rows * dim, offset=EMBED_BINARY_HEADER.size)
+        return matrix.reshape(rows, dim)
+    return np.array(response.json()["embeddings"], dtype=np.float32)
+
+
+def get_embedding_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий для воркера httpx-клиент с keep-alive пулом.
+    Клиент привязан к event loop, поэтому при смене цикла (например, под runserver)
+    создаётся заново.
+    """
+    global _embed_client, _embed_client_loop
+    loop = asyncio.get_running_loop()
+    if _embed_client is None or _embed_client.is_closed or _embed_client_loop is not loop:
+        _embed_client = httpx.AsyncClient(
+            http2=EMBED_HTTP2,
+            limits=EMBED_POOL_LIMITS,
+            timeout=EMBED_TIMEOUT,
+        )
+        _embed_client_loop = loop
+    return _embed_client
+
+
+async def close_embedding_client() -> None:
+    """
+    Закрывает пул соединений; вызывается при остановке ASGI-воркера.
+    """
+    global _embed_client, _embed_client_loop
+    if _embed_client is not None and not _embed_client.is_closed:
+        await _embed_client.aclose()
+    _embed_client = None
+    _embed_client_loop = None
+
 
 async def encode_async_embeddings(texts):
-    async with httpx.AsyncClient() as client:
-        payload = {"texts": texts}
-        response = await client.post(API_URL, json=payload)
-        response.raise_for_status()
-        output = response.json()["embeddings"]
-        return np.array(output)
+    client = get_embedding_client()
+    payload = {"texts": texts}
+    response = await client.post(API_URL, json=payload, headers={"Accept": EMBED_ACCEPT})
+    response.raise_for_status()
+    return decode_embeddings(response)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Ключ кэша: регистр и пробелы не влияют на эмбеддинг uncased-модели.
+    """
+    return " ".join(query.lower().split())
+
+
+def _shared_query_cache():
+    if not QUERY_CACHE_SHARED_ALIAS:
+        return None
+    from django.core.cache import caches
+    return caches[QUERY_CACHE_SHARED_ALIAS]
+
+
+def _shared_cache_key(normalized: str) -> str:
+    return QUERY_CACHE_KEY_PREFIX + hashlib.sha1(normalized.encode()).hexdigest()
+
+
+async def embed_queries(queries) -> np.ndarray:
+    """
+    Эмбеддинги запросов с учётом кэша: в эмбеддинг-сервер уходят только промахи,
+    одним батчем.
+    """
+    keys = [normalize_query(q) for q in queries]
+    vectors = [query_embedding_cache.get(key) for key in keys]
+    shared = _shared_query_cache()
+
+    missing = [i for i, vec in enumerate(vectors) if vec is None]
+    metrics.incr("query_cache.hits", len(keys) - len(missing))
+
+    if missing and shared is not None:
+        try:
+            found = await shared.aget_many([_shared_cache_key(keys[i]) for i in missing])
+        except Exception as e:
+            log.warning(f"Shared query cache unavailable: {e}")
+            found = {}
+        still_missing = []
+        for i in missing:
+            raw = found.get(_shared_cache_key(keys[i]))
+            if raw is None:
+                still_missing.append(i)
+                continue
+            vectors[i] = np.frombuffer(raw, dtype="<f4")
+            query_embedding_cache.set(keys[i], vectors[i])
+        metrics.incr("query_cache.shared_hits", len(missing) - len(still_missing))
+        missing = still_missing
+
+    metrics.incr("query_cache.misses", len(missing))
+    if missing:
+        unique = list(dict.fromkeys(keys[i] for i in missing))
+        embeddings = await encode_async_embeddings(unique)
+        by_key = dict(zip(unique, embeddings))
+        for key, vec in by_key.items():
+            query_embedding_cache.set(key, vec)
+        if shared is not None:
+            try:
+                await shared.aset_many(
+                    {_shared_cache_key(key): np.asarray(vec, dtype="<f4").tobytes() for key, vec in by_key.items()},
+                    timeout=QUERY_CACHE_TTL,
+                )
+            except Exception as e:
+                log.warning(f"Shared query cache unavailable: {e}")
+        for i in missing:
+            vectors[i] = by_key[keys[i]]
 
+    return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
 
-client = QdrantClient(
-    url=f"http://{QDRANT_HOST}:{QDRANT_REST_PORT}",
-    prefer_grpc=False,
-    timeout=30
-)
 
+async def embed_query(query: str) -> np.ndarray:
+    return (await embed_queries([query]))[0]
 
-async def get_relevant_chunks(query: str, top_k: int = 5):
+
+async def prewarm_query_cache(queries) -> None:
+    """
+    Заранее считает эмбеддинги типовых запросов (кнопки-подсказки).
+    """
+    queries = [q for q in queries if q and q.strip()]
+    if queries:
+        await embed_queries(queries)
+        log.info(f"Query embedding cache pre-warmed with {len(queries)} queries.")
+
+
+_qdrant_client = None
+_qdrant_client_loop = None
+
+
+def get_qdrant_client() -> AsyncQdrantClient:
+    """
+    Общий для воркера асинхронный клиент Qdrant (REST с keep-alive пулом или gRPC).
+    Как и клиент эмбеддингов, пересоздаётся при смене event loop.
+    """
+    global _qdrant_client, _qdrant_client_loop
+    loop = asyncio.get_running_loop()
+    if _qdrant_client is None or _qdrant_client_loop is not loop:
+        _qdrant_client = AsyncQdrantClient(
+            url=f"http://{QDRANT_HOST}:{QDRANT_REST_PORT}",
+            grpc_port=QDRANT_GRPC_PORT,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            timeout=QDRANT_TIMEOUT,
+            limits=QDRANT_POOL_LIMITS,
+        )
+        _qdrant_client_loop = loop
+    return _qdrant_client
+
+
+async def close_qdrant_client() -> None:
+    global _qdrant_client, _qdrant_client_loop
+    if _qdrant_client is not None:
+        await _qdrant_client.close()
+    _qdrant_client = None
+    _qdrant_client_loop = None
+
+
+# Есть ли в коллекции разреженные векторы; перепроверяется раз в несколько минут,
+# чтобы после reindex гибридный поиск включился без перезапуска.
+_sparse_support = TTLCache(maxsize=16, ttl=300)
+
+
+async def collection_has_sparse(collection_name: str = COLLECTION_NAME) -> bool:
+    cached = _sparse_support.get(collection_name)
+    if cached is not None:
+        return cached
+    info = await get_qdrant_client().get_collection(collection_name=collection_name)
+    supported = SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+    _sparse_support.set(collection_name, supported)
+    return supported
+
+
+def _hit_to_chunk(hit) -> dict:
+    payload = hit.payload or {}
+    vector = hit.vector.get("") if isinstance(hit.vector, dict) else hit.vector
+    return {
+        "id": hit.id,
+        "text": payload.get("text", ""),
+        "source": payload.get("source"),
+        "page": payload.get("page"),
+        "section": payload.get("section"),
+        "score": getattr(hit, "score", None),
+        "vector": vector,
+    }
+
+
+async def get_chunks_by_ids(ids):
+    """
+    Фрагменты по id точек (например, найденные для предыдущей реплики) без векторного поиска.
+    score не заполняется: релевантность считается при отборе контекста.
+    """
+    if not ids:
+        return []
+    points = await get_qdrant_client().retrieve(
+        collection_name=COLLECTION_NAME,
+        ids=list(ids),
+        with_payload=True,
+        with_vectors=[""] if await collection_has_sparse(COLLECTION_NAME) else True,
+    )
+    by_id = {str(point.id): dict(_hit_to_chunk(point), score=None) for point in points}
+    return [by_id[str(point_id)] for point_id in ids if str(point_id) in by_id]
+
+
+def fuse_rrf(*rankings, limit: int, k: int = RRF_K):
+    """
+    Reciprocal rank fusion нескольких ранжированных списков фрагментов.
+    Итоговый score нормирован на максимум, чтобы его можно было сравнивать
+    с косинусной близостью при отборе контекста.
+    """
+    fused, scores = {}, {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            fused.setdefault(chunk["id"], chunk)
+            scores[chunk["id"]] = scores.get(chunk["id"], 0.0) + 1.0 / (k + rank)
+    order = sorted(scores, key=scores.get, reverse=True)[:limit]
+    if not order:
+        return []
+    best = scores[order[0]]
+    return [dict(fused[point_id], score=scores[point_id] / best) for point_id in order]
+
+
+async def get_relevant_chunks(query: str, top_k: int = 5, query_vector=None):
     """
     Ищет в Qdrant наиболее релевантные фрагменты текста по запросу.
+    Плотный поиск по эмбеддингу и BM25-поиск по ключевым словам (проценты,
+    коды, названия продуктов) выполняются параллельно и сливаются через RRF.
     Возвращает список словарей с полями:
-      - text:  текст фрагмента
+      - id:     идентификатор точки
+      - text:   текст фрагмента
       - source: имя файла-источника
-      - score:  косинусная близость
+      - page, section: положение фрагмента в документе
+      - score:  косинусная близость или нормированный RRF-score
+      - vector: эмбеддинг фрагмента (для дедупликации и MMR)
     """
-    query_emb = await encode_async_embeddings([query])
-    hits = client.search(
+    client = get_qdrant_client()
+    query_emb = query_vector if query_vector is not None else await embed_query(query)
+    sparse_query = query_sparse_vector(query)
+    hybrid = HYBRID_SEARCH and sparse_query.indices and await collection_has_sparse(COLLECTION_NAME)
+
+    dense = client.search(
+        collection_name=COLLECTION_NAME,
+        query_vector=query_emb,
+        limit=top_k,
+        search_params=search_params(get_profile()),
+        with_payload=True,
+        with_vectors=True
+    )
+    if not hybrid:
+        return [_hit_to_chunk(hit) for hit in await dense]
+
+    sparse = client.search(
         collection_name=COLLECTION_NAME,
-        query_vector=query_emb[0],
+        query_vector=models.NamedSparseVector(name=SPARSE_VECTOR_NAME, vector=sparse_query),
         limit=top_k,
-        with_payload=True
+        with_payload=True,
+        with_vectors=[""],
     )
-    results = []
-    for hit in hits:
-        payload = hit.payload
-        results.append(payload.get("text", ""), )
-    return results
+    dense_hits, sparse_hits = await asyncio.gather(dense, sparse, return_exceptions=True)
+    if isinstance(dense_hits, BaseException):
+        raise dense_hits
+    if isinstance(sparse_hits, BaseException):
+        log.warning(f"Sparse search failed, using dense results only: {sparse_hits}")
+        metrics.incr("search.sparse_errors")
+        return [_hit_to_chunk(hit) for hit in dense_hits]
+
+    dense_chunks = [_hit_to_chunk(hit) for hit in dense_hits]
+    sparse_chunks = [_hit_to_chunk(hit) for hit in sparse_hits]
+    metrics.incr("search.hybrid")
+    metrics.incr("search.sparse_only_hits", len({c["id"] for c in sparse_chunks} - {c["id"] for c in dense_chunks}))
+    return fuse_rrf(dense_chunks, sparse_chunks, limit=top_k)
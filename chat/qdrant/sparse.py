@@ -0,0 +1,71 @@
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+from qdrant_client import models
+
+# ————— НАСТРОЙКИ —————
+SPARSE_VECTOR_NAME = "bm25"
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Средняя длина чанка в терминах (CHUNK_TOKENS токенов MiniLM — примерно столько слов).
+BM25_AVG_TERMS = 100
+# Слова длиннее обрезаются до этой длины: грубый стемминг для русских окончаний.
+STEM_LENGTH = 6
+# ————————————————————
+
+# Числа с дробной частью и процентом ("1,5%", "0.3"), коды счетов и слова.
+TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*%?|[a-zа-яё0-9]+", re.IGNORECASE)
+
+STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всех вы где да даже для до его ее если
+есть еще же за здесь и из или им их к как ко когда кто ли либо мне может мы на над не него нет ни них но
+ну о об однако он она они оно от очень по под после при с со так также такой там те тем то того тоже той
+только том ты у уже хотя чем что чтобы эта эти это этот я
+the of and or to in for on by with is are be as at an a
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Термы для ключевого поиска: нижний регистр, без стоп-слов, слова обрезаны
+    до STEM_LENGTH символов; числа и проценты сохраняются целиком.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in STOPWORDS:
+            continue
+        if token.isalpha() and len(token) > STEM_LENGTH:
+            token = token[:STEM_LENGTH]
+        terms.append(token)
+    return terms
+
+
+def term_index(term: str) -> int:
+    return zlib.crc32(term.encode())
+
+
+def _sparse_vector(weights: Counter) -> models.SparseVector:
+    by_index = Counter()
+    for term, weight in weights.items():
+        by_index[term_index(term)] += weight
+    indices = sorted(by_index)
+    return models.SparseVector(indices=indices, values=[float(by_index[i]) for i in indices])
+
+
+def document_sparse_vector(text: str) -> models.SparseVector:
+    """
+    BM25-вес терма в документе: насыщение частоты с нормировкой на длину.
+    IDF сюда не входит — скалярное произведение с вектором запроса даёт
+    BM25 без IDF, а самые частые слова отсекаются стоп-списком.
+    """
+    counts = Counter(tokenize(text))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(counts.values()) / BM25_AVG_TERMS)
+    return _sparse_vector(Counter({
+        term: tf * (BM25_K1 + 1) / (tf + length_norm) for term, tf in counts.items()
+    }))
+
+
+def query_sparse_vector(text: str) -> models.SparseVector:
+    return _sparse_vector(Counter(dict.fromkeys(tokenize(text), 1.0)))
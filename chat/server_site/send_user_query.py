@@ -1,8 +1,10 @@
 import asyncio
 import json
 import logging
+import time
 import uuid
-from contextlib import suppress
+from contextlib import nullcontext, suppress
+from typing import NamedTuple
 
 import aio_pika
 from aio_pika.exceptions import AMQPConnectionError, ChannelClosed, ConnectionClosed
@@ -11,7 +13,28 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 log = logging.getLogger(__name__)
 
 RABBITMQ_HOST = '195.161.62.198'
-TASK_QUEUE_NAME = 'llm_task_queue'
+# Priority queue: a new name, because RabbitMQ cannot add x-max-priority to the
+# existing durable 'llm_task_queue'. Must match the worker's declaration.
+TASK_QUEUE_NAME = 'llm_task_queue_prio'
+TASK_QUEUE_MAX_PRIORITY = 10
+TASK_QUEUE_ARGUMENTS = {'x-max-priority': TASK_QUEUE_MAX_PRIORITY}
+# Absolute deadline (unix time) after which the worker drops the task unanswered.
+DEADLINE_HEADER = 'x-deadline'
+# Replies come through RabbitMQ direct reply-to: a pseudo-queue consumed in no-ack
+# mode on the publishing channel, so no callback queue is declared and replies are
+# never stored. All calls and streams of the client share this one consumer and
+# are told apart by correlation id. Set to False to use an exclusive callback queue.
+USE_DIRECT_REPLY_TO = True
+DIRECT_REPLY_TO_QUEUE = 'amq.rabbitmq.reply-to'
+# Requests whose deadline is at most this many seconds are published as transient
+# messages: a chat answer is worthless after a broker restart, so it is not fsynced.
+TRANSIENT_DEADLINE_SEC = 120
+# Fanout exchange for cancellations: a stream closed or cancelled by the caller
+# publishes its correlation id so the worker stops generating it.
+CANCEL_EXCHANGE_NAME = 'llm_cancel'
+CANCEL_MESSAGE_TTL = 60
+# Queue depth is read with a queue declare; the result is reused for this long.
+QUEUE_DEPTH_CACHE_SEC = 1.0
 DEFAULT_TIMEOUT = 60
 HEARTBEAT_INTERVAL = 60
 
@@ -19,13 +42,28 @@ MSG_TYPE_CHUNK = "chunk"
 MSG_TYPE_END = "end"
 MSG_TYPE_ERROR = "error"
 
+# Generation profiles understood by the worker and their message priorities.
+PROFILE_DEFAULT = "default"
+PROFILE_SUGGESTIONS = "suggestions"
+PROFILE_SUMMARY = "summary"
+PRIORITY_INTERACTIVE = 8
+PRIORITY_SUGGESTIONS = 5
+PRIORITY_BATCH = 1
+
 STREAM_END_MARKER = object()
 STREAM_ERROR_MARKER = object()
 
 
+class StreamDelta(NamedTuple):
+    """One reassembled stream step: the new text, the full text so far, and whether it replaces it."""
+    content: str
+    text: str
+    replace: bool = False
+
+
 class AsyncLlmRpcClient:
     def __init__(self, loop: asyncio.AbstractEventLoop = None):
-        self.loop = asyncio.get_running_loop()
+        self._loop = loop
         self.connection = None
         self.channel = None
         self.callback_queue = None
@@ -33,6 +71,16 @@ class AsyncLlmRpcClient:
         self._response_futures = {}
         self._stream_queues = {}
         self._connection_lock = asyncio.Lock()
+        self._queue_depth = None
+        self._queue_depth_at = 0.0
+        self._cancel_exchange = None
+        self._cancel_tasks = set()
+        self._reply_iterator = None
+
+    @property
+    def loop(self):
+        # The client is created at import time (chat.views), before any event loop runs.
+        return self._loop or asyncio.get_running_loop()
 
     async def _connect(self):
         """Establishes connection, channel, callback queue, and starts consumer."""
@@ -59,10 +107,11 @@ class AsyncLlmRpcClient:
                 self.channel.close_callbacks.add(self._handle_channel_close)
                 log.info(" [*] Channel opened.")
 
-                self.callback_queue = await self.channel.declare_queue(
-                    exclusive=True, auto_delete=True
+                await self._setup_reply_consumer()
+                await self._declare_task_queue()
+                self._cancel_exchange = await self.channel.declare_exchange(
+                    CANCEL_EXCHANGE_NAME, aio_pika.ExchangeType.FANOUT
                 )
-                log.info(f" [*] Callback queue declared: {self.callback_queue.name}")
 
                 self._consumer_task = self.loop.create_task(self._consume_responses())
                 log.info(" [*] Connection and setup successful. Consumer task started.")
@@ -77,11 +126,26 @@ class AsyncLlmRpcClient:
                 await self._safe_close()
                 return False
 
+    async def _setup_reply_consumer(self):
+        """
+        Declares the reply queue and registers its consumer. Direct reply-to requires
+        the consumer to exist before the first publish, so this is not left to the
+        consumer task.
+        """
+        if USE_DIRECT_REPLY_TO:
+            self.callback_queue = await self.channel.get_queue(DIRECT_REPLY_TO_QUEUE, ensure=False)
+        else:
+            self.callback_queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+        self._reply_iterator = self.callback_queue.iterator(no_ack=USE_DIRECT_REPLY_TO)
+        await self._reply_iterator.consume()
+        log.info(f" [*] Callback queue declared: {self.callback_queue.name}")
+
     def _handle_connection_close(self, sender, exc=None):
         log.warning(f" [!] RabbitMQ connection closed. Sender: {sender}, Exception: {exc}")
         self.connection = None
         self.channel = None
         self.callback_queue = None
+        self._reply_iterator = None
         if self._consumer_task and not self._consumer_task.done():
             self._consumer_task.cancel()
         self._fail_pending_requests("Connection closed")
@@ -94,6 +158,7 @@ class AsyncLlmRpcClient:
         log.info(f" [!] RabbitMQ connection re-established by connect_robust. Sender: {sender}")
         self.channel = None
         self.callback_queue = None
+        self._reply_iterator = None
         if self._consumer_task and not self._consumer_task.done():
             self._consumer_task.cancel()
             self._consumer_task = None
@@ -117,14 +182,15 @@ class AsyncLlmRpcClient:
 
     async def _consume_responses(self):
         """Background task to consume messages from the callback queue."""
-        if not self.callback_queue:
+        if not self.callback_queue or not self._reply_iterator:
             log.error("[!] Consumer task started without a callback queue.")
             return
 
         log.info(f" [*] Consumer task starting for queue: {self.callback_queue.name}")
         try:
-            async for message in self.callback_queue:
-                async with message.process(ignore_processed=True):
+            async for message in self._reply_iterator:
+                # Direct reply-to deliveries are consumed in no-ack mode and must not be acked.
+                async with nullcontext() if USE_DIRECT_REPLY_TO else message.process(ignore_processed=True):
                     corr_id = message.correlation_id
                     if not corr_id:
                         log.warning(f" [!] Received message without correlation_id. Body: {message.body[:100]}")
@@ -139,7 +205,7 @@ class AsyncLlmRpcClient:
 
                             if msg_type == MSG_TYPE_CHUNK:
                                 if content is not None:
-                                    await stream_queue.put(content)
+                                    await stream_queue.put(data)
                                 else:
                                     log.warning(f" [!] Stream chunk for {corr_id} has null content.")
                             elif msg_type == MSG_TYPE_END:
@@ -207,7 +273,7 @@ class AsyncLlmRpcClient:
 
                 if not self.callback_queue or self.callback_queue.name is None:
                     log.warning("Callback queue seems lost, re-declaring...")
-                    self.callback_queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+                    await self._setup_reply_consumer()
                     if self._consumer_task and not self._consumer_task.done():
                         self._consumer_task.cancel()
                     self._consumer_task = self.loop.create_task(self._consume_responses())
@@ -227,16 +293,78 @@ class AsyncLlmRpcClient:
                 self._consumer_task is not None and not self._consumer_task.done()
         )
 
-    async def _publish_message(self, corr_id, request_body, reply_to_queue):
-        """Publishes a message to the task queue."""
+    async def _declare_task_queue(self):
+        """Declares the task queue (idempotent) and returns the number of waiting messages."""
+        queue = await self.channel.declare_queue(TASK_QUEUE_NAME, durable=True, arguments=TASK_QUEUE_ARGUMENTS)
+        self._queue_depth = queue.declaration_result.message_count
+        self._queue_depth_at = time.monotonic()
+        return self._queue_depth
+
+    async def queue_depth(self):
+        """
+        Number of tasks waiting for a worker, cached for QUEUE_DEPTH_CACHE_SEC.
+        Returns None when the broker is unavailable.
+        """
+        if self._queue_depth is not None and time.monotonic() - self._queue_depth_at < QUEUE_DEPTH_CACHE_SEC:
+            return self._queue_depth
+        try:
+            await self._ensure_connection()
+            return await self._declare_task_queue()
+        except Exception as e:
+            log.warning(f" [!] Failed to read task queue depth: {e}")
+            return None
+
+    async def _publish_cancel(self, corr_id):
+        try:
+            if self._cancel_exchange is None or not self.is_connected():
+                log.warning(f" [!] Not connected, cancel for {corr_id} not sent.")
+                return
+            await self._cancel_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps({'correlation_id': corr_id}).encode(),
+                    content_type='application/json',
+                    expiration=CANCEL_MESSAGE_TTL,
+                ),
+                routing_key='',
+            )
+            log.info(f" [x] Cancel published (CorrID: {corr_id})")
+        except Exception as e:
+            log.warning(f" [!] Failed to publish cancel for {corr_id}: {e}")
+
+    def _cancel_request(self, corr_id):
+        """
+        Tells the workers to stop generating corr_id. Runs as a separate task, because
+        it is called while the caller's own task is being cancelled or its generator closed.
+        """
+        task = self.loop.create_task(self._publish_cancel(corr_id))
+        self._cancel_tasks.add(task)
+        task.add_done_callback(self._cancel_tasks.discard)
+
+    async def _publish_message(self, corr_id, request_body, reply_to_queue, priority=None, timeout_sec=None):
+        """
+        Publishes a message to the task queue. With timeout_sec the message expires in
+        the broker after that time and carries a deadline for the worker: a task nobody
+        waits for any more is not generated.
+        """
         await self._ensure_connection()
 
+        headers = None
+        expiration = None
+        delivery_mode = aio_pika.DeliveryMode.PERSISTENT
+        if timeout_sec:
+            headers = {DEADLINE_HEADER: time.time() + timeout_sec}
+            expiration = timeout_sec
+            if timeout_sec <= TRANSIENT_DEADLINE_SEC:
+                delivery_mode = aio_pika.DeliveryMode.NOT_PERSISTENT
         message = aio_pika.Message(
             body=request_body.encode(),
             correlation_id=corr_id,
             reply_to=reply_to_queue,
             content_type='application/json',
-            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            delivery_mode=delivery_mode,
+            priority=priority,
+            headers=headers,
+            expiration=expiration,
         )
         try:
             await self.channel.default_exchange.publish(
@@ -249,20 +377,39 @@ class AsyncLlmRpcClient:
             log.exception(f" [!] Unexpected error publishing message (CorrID: {corr_id}): {e}")
             return False
 
-    async def call(self, user_message, user_id="default_user", timeout_sec=DEFAULT_TIMEOUT):
+    @staticmethod
+    def _request_body(user_message, user_id, profile, system_prompt, cache_salt, stream=False):
+        """
+        Task payload. The worker renders system_prompt ahead of the message with the
+        model's chat template; cache_salt is an optional per-session hint for the
+        backend's prefix cache.
+        """
+        request = {
+            'user_id': user_id,
+            'message': user_message,
+            'profile': profile,
+        }
+        if system_prompt:
+            request['system'] = system_prompt
+        if cache_salt:
+            request['cache_salt'] = cache_salt
+        if stream:
+            request['stream'] = True
+        return json.dumps(request)
+
+    async def call(self, user_message, user_id="default_user", timeout_sec=DEFAULT_TIMEOUT,
+                   profile=PROFILE_DEFAULT, priority=PRIORITY_INTERACTIVE, system_prompt=None, cache_salt=None):
         """Sends a request and waits for a single JSON response."""
         await self._ensure_connection()
         corr_id = str(uuid.uuid4())
         future = self.loop.create_future()
         self._response_futures[corr_id] = future
 
-        request_body = json.dumps({
-            'user_id': user_id,
-            'message': user_message,
-        })
+        request_body = self._request_body(user_message, user_id, profile, system_prompt, cache_salt)
 
-        log.info(f" [x] Sending request (call) '{user_message[:30]}...' (ID: {corr_id})")
-        published = await self._publish_message(corr_id, request_body, self.callback_queue.name)
+        log.info(f" [x] Sending request (call, {profile}) '{user_message[:30]}...' (ID: {corr_id})")
+        published = await self._publish_message(corr_id, request_body, self.callback_queue.name, priority,
+                                                 timeout_sec)
 
         if not published:
             if corr_id in self._response_futures: del self._response_futures[corr_id]
@@ -276,9 +423,11 @@ class AsyncLlmRpcClient:
             return result
         except asyncio.TimeoutError:
             log.error(f" [!] Timeout waiting for response (call) for {corr_id}")
+            self._cancel_request(corr_id)
             return {"error": f"Timeout waiting for LLM response (call) after {timeout_sec} seconds"}
         except asyncio.CancelledError:
             log.warning(f" [!] Call request {corr_id} was cancelled.")
+            self._cancel_request(corr_id)
             return {"error": "Call request cancelled"}
         except Exception as e:
             log.exception(f" [!] Error waiting for future {corr_id}: {e}")
@@ -287,32 +436,39 @@ class AsyncLlmRpcClient:
             if corr_id in self._response_futures:
                 del self._response_futures[corr_id]
 
-    async def stream(self, user_message, user_id="default_user", timeout_sec=DEFAULT_TIMEOUT):
+    async def stream(self, user_message, user_id="default_user", timeout_sec=DEFAULT_TIMEOUT,
+                     profile=PROFILE_DEFAULT, priority=PRIORITY_INTERACTIVE, system_prompt=None, cache_salt=None):
         """
-        Sends a request and yields response chunks asynchronously.
+        Sends a request and yields response deltas asynchronously.
+
+        Protocol v2 chunks carry only new text plus a sequence number; a gap in the
+        sequence fails the stream. Legacy (v1) chunks carry the whole text so far
+        and are converted to deltas here.
 
         Yields:
-            str: Chunks of the response content.
+            StreamDelta: The new text, the reassembled text so far, and the replace flag.
         """
         await self._ensure_connection()
         corr_id = str(uuid.uuid4())
         queue = asyncio.Queue()
         self._stream_queues[corr_id] = queue
 
-        request_body = json.dumps({
-            'user_id': user_id,
-            'message': user_message,
-            'stream': True
-        })
+        request_body = self._request_body(user_message, user_id, profile, system_prompt, cache_salt, stream=True)
 
         log.info(f" [x] Sending request (stream) '{user_message[:30]}...' (ID: {corr_id})")
-        published = await self._publish_message(corr_id, request_body, self.callback_queue.name)
+        published = await self._publish_message(corr_id, request_body, self.callback_queue.name, priority,
+                                                 timeout_sec)
 
         if not published:
             if corr_id in self._stream_queues: del self._stream_queues[corr_id]
             raise ConnectionError("Failed to publish stream message")
 
         log.info(f" [.] Waiting for stream data for {corr_id} (Inactivity Timeout: {timeout_sec}s)")
+        assembled = ""
+        expected_seq = 1
+        # The worker is done with the task only after END or its own error; in every
+        # other case (closed generator, cancellation, timeout) it is told to stop.
+        worker_finished = False
         try:
             while True:
                 try:
@@ -320,8 +476,10 @@ class AsyncLlmRpcClient:
 
                     if item is STREAM_END_MARKER:
                         log.info(f" [.] Stream {corr_id} ended normally.")
+                        worker_finished = True
                         break
                     elif item is STREAM_ERROR_MARKER:
+                        worker_finished = True
                         error_content = "Unknown stream error"
                         try:
                             error_content = await asyncio.wait_for(queue.get(), timeout=1)
@@ -333,8 +491,23 @@ class AsyncLlmRpcClient:
                         log.error(f" [!] Stream {corr_id} ended with error: {error_content}")
                         raise RuntimeError(f"Stream error from worker or processing: {error_content}")
                     else:
-                        yield item
                         queue.task_done()
+                        content = item["content"]
+                        if item.get("v", 1) >= 2:
+                            seq = item.get("seq")
+                            if seq != expected_seq:
+                                log.error(f" [!] Stream {corr_id} sequence gap: expected {expected_seq}, got {seq}")
+                                raise RuntimeError(f"Stream chunk lost: expected seq {expected_seq}, got {seq}")
+                            expected_seq += 1
+                            replace = bool(item.get("replace", False))
+                            delta = content
+                        else:
+                            replace = not content.startswith(assembled)
+                            delta = content if replace else content[len(assembled):]
+                            if not delta and not replace:
+                                continue
+                        assembled = delta if replace else assembled + delta
+                        yield StreamDelta(delta, assembled, replace)
 
                 except asyncio.TimeoutError:
                     log.error(f" [!] Stream {corr_id} timed out due to inactivity after {timeout_sec} seconds.")
@@ -347,6 +520,8 @@ class AsyncLlmRpcClient:
                     raise RuntimeError(f"Internal error processing stream queue: {e}") from e
 
         finally:
+            if not worker_finished:
+                self._cancel_request(corr_id)
             if corr_id in self._stream_queues:
                 log.info(f" [.] Cleaning up queue for stream {corr_id}")
                 while not queue.empty():
@@ -381,6 +556,7 @@ class AsyncLlmRpcClient:
             self.connection = None
 
         self.callback_queue = None
+        self._reply_iterator = None
         self._fail_pending_requests("Client closed")
         log.info(" [*] Safe close finished.")
 
@@ -1,2 +1,9 @@
+INITIAL_SUGGESTIONS = [
+    "Какие условия международных переводов?",
+    "Какие условия переводов внутри страны?",
+    "Расскажи о преимуществах Газпромбанка",
+]
+
+
 def generate_response(user_message: str) -> str:
-    return f'Заглушка ответа на: "{user_message}"'
\ No newline at end of file
+    return f'Заглушка ответа на: "{user_message}"'
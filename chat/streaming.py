@@ -0,0 +1,46 @@
+import time
+
+# Склейка дельт ответа в NDJSON-строки: буфер отправляется, когда прошло
+# CHAT_FLUSH_INTERVAL_MS с предыдущей отправки или накопилось CHAT_FLUSH_BYTES,
+# смотря что наступит раньше. Первый фрагмент отправляется сразу.
+CHAT_FLUSH_INTERVAL_MS = 50
+CHAT_FLUSH_BYTES = 512
+
+
+class ChunkCoalescer:
+    """
+    Копит дельты StreamDelta и отдаёт готовое событие 'chunk', когда пора сбросить буфер.
+    Срок проверяется при поступлении следующей дельты; остаток забирается через flush().
+    """
+
+    def __init__(self, flush_interval_ms: float = CHAT_FLUSH_INTERVAL_MS, flush_bytes: int = CHAT_FLUSH_BYTES):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.pending = ""
+        self.replace = False
+        self.flushed_any = False
+        self.last_flush = time.monotonic()
+
+    def push(self, delta):
+        if delta.replace:
+            self.pending = delta.content
+            self.replace = True
+        else:
+            self.pending += delta.content
+        if (not self.flushed_any
+                or len(self.pending.encode()) >= self.flush_bytes
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.pending and not self.replace:
+            return None
+        event = {'type': 'chunk', 'content': self.pending}
+        if self.replace:
+            event['replace'] = True
+        self.pending = ""
+        self.replace = False
+        self.flushed_any = True
+        self.last_flush = time.monotonic()
+        return event
@@ -6,6 +6,8 @@ app_name = 'chat'
 urlpatterns = [
     path('', views.index, name='index'),
     path('api/chat/', views.api_chat, name='api_chat'),
+    path('api/metrics/', views.api_metrics, name='api_metrics'),
     path('upload/', views.upload_page, name='upload_page'),
-    path('submit/', views.handle_upload, name='handle_upload')
+    path('submit/', views.handle_upload, name='handle_upload'),
+    path('api/upload/<uuid:job_id>/', views.upload_status, name='upload_status'),
 ]
@@ -1,75 +1,203 @@
+import asyncio
 import json
 import os
-import io
-import uuid
 
-from django.shortcuts import render, redirect
-from django.http import StreamingHttpResponse, JsonResponse
+from django.shortcuts import render
+from django.http import StreamingHttpResponse, JsonResponse, Http404
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 
-from .qdrant.search import get_relevant_chunks, encode_async_embeddings
-from .server_site.send_user_query import AsyncLlmRpcClient
-from .qdrant.parsing import (
-    extract_text_from_pdf,
-    extract_text_from_docx,
-    chunk_text,
-    client as qdrant_client,
-    COLLECTION_NAME,
-    BATCH_SIZE,
+from . import metrics
+from .answer_cache import answer_cache
+from .jobs import create_job, job_status
+from .memory import append_turn, format_history, is_followup, load_history, schedule_compaction
+from .models import IngestionJob
+from .prompt import (
+    SYSTEM_PROMPT,
+    build_answer_message,
+    build_suggestions_message,
+    cache_salt,
+    format_context,
 )
+from .qdrant.search import (
+    get_chunks_by_ids,
+    get_relevant_chunks,
+    embed_query,
+    query_embedding_cache,
+)
+from .services import INITIAL_SUGGESTIONS
+from .streaming import ChunkCoalescer
+from .server_site.send_user_query import (
+    AsyncLlmRpcClient,
+    PROFILE_SUGGESTIONS,
+    PROFILE_SUMMARY,
+    PRIORITY_SUGGESTIONS,
+    PRIORITY_BATCH,
+)
+from .qdrant.context import build_context
+from .qdrant.rerank import rerank_chunks
 
 llm_client = AsyncLlmRpcClient()
 
+RETRIEVAL_TOP_K = 20
+SUGGESTIONS_TIMEOUT = 20
+SUMMARY_TIMEOUT = 60
+# Если в очереди LLM ждёт больше задач, новый вопрос сразу получает 503 вместо долгого ожидания.
+ADMISSION_MAX_QUEUE_DEPTH = 100
+ADMISSION_RETRY_AFTER = 5
+
 
 @csrf_exempt
 async def index(request):
-    initial_buttons = [
-        {"text": "Какие условия международных переводов?"},
-        {"text": "Какие условия переводов внутри страны?"},
-        {"text": "Расскажи о преимуществах Газпромбанка"},
-    ]
+    initial_buttons = [{"text": text} for text in INITIAL_SUGGESTIONS]
     return render(request, 'chat/index.html', {'initial_buttons': initial_buttons})
 
 
-async def stream_llm_response(user_msg):
+def parse_suggestions(buttons_response: str):
+    buttons = []
+    try:
+        cleaned_json = buttons_response.strip().lstrip('```json').rstrip('```').strip()
+        cleaned_json = cleaned_json.strip().lstrip('```json').rstrip('```').strip()
+        cleaned_json = cleaned_json.replace("'", '"')
+        cleaned_json = cleaned_json.replace('```', '').replace('json', '').strip()
+        cleaned_json = cleaned_json[cleaned_json.find('['):]
+        print(cleaned_json)
+        parsed_buttons = json.loads(cleaned_json)
+        buttons = [{'text': item['question'].strip()} for item in parsed_buttons]
+    except Exception as e:
+        print(f"Другая ошибка при обработке кнопок: {e}")
+    return buttons
+
+
+async def generate_suggestions(user_msg, context, session_key):
+    """
+    Подсказки строятся по запросу и найденному контексту, а не по готовому ответу,
+    поэтому запускаются параллельно с основной генерацией — в облегчённом профиле
+    и с более низким приоритетом в очереди.
+    """
+    buttons_response = await llm_client.call(
+        build_suggestions_message(context, user_msg),
+        user_id=session_key,
+        timeout_sec=SUGGESTIONS_TIMEOUT,
+        profile=PROFILE_SUGGESTIONS,
+        priority=PRIORITY_SUGGESTIONS,
+        system_prompt=SYSTEM_PROMPT,
+        cache_salt=cache_salt(session_key),
+    )
+    return parse_suggestions(buttons_response.get('llm_response', ''))
+
+
+async def summarize_history(summary, turns):
+    """
+    Сводка старых реплик диалога для memory.compact_history: фоновый запрос
+    с самым низким приоритетом, чтобы не задерживать ответы пользователям.
+    """
+    dialog = "\n".join(f"Пользователь: {turn['user']}\nПомощник: {turn['assistant']}" for turn in turns)
+    prompt = ("Кратко, в 3-5 предложениях, перескажи диалог клиента с помощником банка. "
+              "Сохрани вопросы клиента, названия продуктов, цифры и условия.\n")
+    if summary:
+        prompt += f"Краткое содержание более раннего диалога: {summary}\n"
+    prompt += dialog
+
+    response = await llm_client.call(
+        prompt,
+        timeout_sec=SUMMARY_TIMEOUT,
+        profile=PROFILE_SUMMARY,
+        priority=PRIORITY_BATCH,
+        system_prompt=SYSTEM_PROMPT,
+    )
+    text = (response.get('llm_response') or '').strip()
+    if not text:
+        raise RuntimeError(response.get('error', 'empty summary'))
+    return text
+
+
+async def retrieve_context(user_msg, query_vector, history):
+    """
+    Фрагменты для ответа. Уточняющий вопрос переиспользует фрагменты
+    предыдущей реплики по id, не повторяя векторный поиск и rerank.
+    """
+    previous = history['turns'][-1] if history['turns'] else None
+    if previous and previous['chunk_ids']:
+        previous_vector = await embed_query(previous['user'])
+        if is_followup(user_msg, query_vector, previous_vector):
+            hits = await get_chunks_by_ids(previous['chunk_ids'])
+            if hits:
+                metrics.incr("memory.followups")
+                return build_context(hits, query_vector)
+
+    found = await get_relevant_chunks(user_msg, top_k=RETRIEVAL_TOP_K, query_vector=query_vector)
+    reranked = await rerank_chunks(user_msg, found)
+    return build_context(reranked, query_vector)
+
+
+async def stream_llm_response(user_msg, session_key):
+    suggestions_task = None
     try:
-        found = await get_relevant_chunks(user_msg, top_k=30)
-        context_prompt = f"Найдены документы по запросу пользователя: {' '.join(found)}."
-        context_prompt = context_prompt.replace('\n', ' ')
-        full_prompt = context_prompt + "\n Пользователь написал: \n" + user_msg + "\n по умолчанию отвечай про газпромбанк, если не указаны конкретные источники, разделяй ответ на блоки, чтобы удобнее читалось, и используй конкретные цифры для описания комиссии и других аспектов."
+        query_vector = await embed_query(user_msg)
+        history = await load_history(session_key)
+        # Кэш ответов годится только для первой реплики: дальше ответ зависит от истории.
+        first_turn = not history['turns'] and not history['summary']
+        if first_turn:
+            cached = await answer_cache.lookup(query_vector)
+            if cached is not None:
+                answer, buttons = cached
+                yield json.dumps({'type': 'chunk', 'content': answer}) + '\n'
+                yield json.dumps({'type': 'suggestions', 'content': buttons}) + '\n'
+                await append_turn(session_key, user_msg, answer, [])
+                return
+
+        selected = await retrieve_context(user_msg, query_vector, history)
+        context = format_context(selected)
+        suggestions_task = asyncio.create_task(generate_suggestions(user_msg, context, session_key))
+
+        history_text = format_history(history)
+        if history_text:
+            metrics.incr("memory.history_turns", len(history['turns']))
+        full_prompt = build_answer_message(context, history_text, user_msg)
         complete_response_text = ""
+        buttons = None
+
+        coalescer = ChunkCoalescer()
+        async for delta in llm_client.stream(full_prompt, user_id=session_key, timeout_sec=20,
+                                             system_prompt=SYSTEM_PROMPT, cache_salt=cache_salt(session_key)):
+            complete_response_text = delta.text
+            event = coalescer.push(delta)
+            if event is not None:
+                yield json.dumps(event) + '\n'
+            if buttons is None and suggestions_task.done():
+                buttons = suggestions_task.result() if not suggestions_task.exception() else []
+                yield json.dumps({'type': 'suggestions', 'content': buttons}) + '\n'
+        event = coalescer.flush()
+        if event is not None:
+            yield json.dumps(event) + '\n'
 
-        async for chunk in llm_client.stream(full_prompt, timeout_sec=20):
-            complete_response_text = chunk
-            yield json.dumps({'type': 'chunk', 'content': chunk}) + '\n'
-
-        prompt_buttons = (complete_response_text +
-                          " Предложи три вопроса, которые может задать пользователь далее. "
-                          "Вопросы отдай строго в json формате, чтобы сработала команда json.load(). "
-                          "[{'question': ''}, {'question': ''}, {'question': ''}].")
-
-        buttons_response = await llm_client.call(prompt_buttons)
-        buttons_response = buttons_response.get('llm_response', '')
-        buttons = []
-        try:
-            cleaned_json = buttons_response.strip().lstrip('```json').rstrip('```').strip()
-            cleaned_json = cleaned_json.strip().lstrip('```json').rstrip('```').strip()
-            cleaned_json = cleaned_json.replace("'", '"')
-            cleaned_json = cleaned_json.replace('```', '').replace('json', '').strip()
-            cleaned_json = cleaned_json[cleaned_json.find('['):]
-            print(cleaned_json)
-            parsed_buttons = json.loads(cleaned_json)
-            buttons = [{'text': item['question'].strip()} for item in parsed_buttons]
-        except Exception as e:
-            print(f"Другая ошибка при обработке кнопок: {e}")
-
-        yield json.dumps({'type': 'suggestions', 'content': buttons}) + '\n'
+        if buttons is None:
+            try:
+                buttons = await asyncio.wait_for(suggestions_task, timeout=SUGGESTIONS_TIMEOUT)
+            except Exception as e:
+                print(f"Подсказки не получены: {e}")
+                buttons = []
+            yield json.dumps({'type': 'suggestions', 'content': buttons}) + '\n'
 
+        if complete_response_text:
+            await append_turn(session_key, user_msg, complete_response_text,
+                              [hit['id'] for hit in selected])
+            schedule_compaction(session_key, summarize_history)
+            if first_turn:
+                await answer_cache.store(query_vector, complete_response_text, buttons)
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # Клиент закрыл соединение: генерация в воркере отменяется в llm_client.stream.
+        metrics.incr("llm.abandoned_streams")
+        raise
     except Exception as e:
         print(f"Ошибка в stream_llm_response: {e}")
         yield json.dumps({'type': 'error', 'content': 'Произошла ошибка на сервере.'}) + '\n'
+    finally:
+        if suggestions_task is not None and not suggestions_task.done():
+            suggestions_task.cancel()
 
 
 @require_GET
@@ -91,32 +219,18 @@ async def handle_upload(request):
     if uploaded.size > 100 * 1024 * 1024:
         return JsonResponse({'error': 'Размер файла превышает 100 MB.'}, status=400)
 
-    data = uploaded.read()
-
-    if ext == '.pdf':
-        text = extract_text_from_pdf(io.BytesIO(data))
-    elif ext == '.docx':
-        text = extract_text_from_docx(io.BytesIO(data))
-    else:
-        text = data.decode(errors='ignore')
-
-    chunks = chunk_text(text)
-    embeddings = await encode_async_embeddings(chunks)
+    job = await create_job(uploaded, name, ext)
+    status_url = reverse('chat:upload_status', args=[job.id])
+    return JsonResponse({'job_id': str(job.id), 'status_url': status_url}, status=202)
 
-    points = []
-    for chunk, emb in zip(chunks, embeddings):
-        points.append({
-            'id': str(uuid.uuid4()),
-            'vector': emb,
-            'payload': {'text': chunk, 'source': name}
-        })
-        if len(points) >= BATCH_SIZE:
-            qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
-            points.clear()
-    if points:
-        qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
 
-    return redirect(reverse('chat:index'))
+@require_GET
+async def upload_status(request, job_id):
+    try:
+        job = await IngestionJob.objects.aget(pk=job_id)
+    except IngestionJob.DoesNotExist:
+        raise Http404('Задание не найдено.')
+    return JsonResponse(job_status(job))
 
 
 @csrf_exempt
@@ -128,8 +242,19 @@ async def api_chat(request):
         if not user_msg:
             return JsonResponse({'error': 'Сообщение не может быть пустым'}, status=400)
 
+        depth = await llm_client.queue_depth()
+        if depth is not None and depth > ADMISSION_MAX_QUEUE_DEPTH:
+            metrics.incr("admission.rejected")
+            response = JsonResponse({'error': 'Сервис перегружен, повторите запрос позже.'}, status=503)
+            response['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+            return response
+
+        # История диалога привязана к сессии Django; сессия создаётся при первом сообщении.
+        if request.session.session_key is None:
+            await request.session.acreate()
+
         response = StreamingHttpResponse(
-            stream_llm_response(user_msg),
+            stream_llm_response(user_msg, request.session.session_key),
             content_type='application/x-ndjson'
         )
         return response
@@ -139,3 +264,10 @@ async def api_chat(request):
     except Exception as e:
         print(f"Ошибка в api_chat view: {e}")
         return JsonResponse({'error': 'Внутренняя ошибка сервера'}, status=500)
+
+
+@require_GET
+async def api_metrics(request):
+    data = metrics.snapshot()
+    data["query_cache.size"] = len(query_embedding_cache)
+    return JsonResponse(data)
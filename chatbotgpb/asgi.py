@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbotgpb.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chat.lifespan import LifespanMiddleware  # noqa: E402  (после настройки Django)
+
+application = LifespanMiddleware(django_application)
@@ -53,4 +53,8 @@ DATABASES = {
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'chat' / 'static']
 
+# Загрузки больше этого размера Django пишет во временный файл, а не держит в памяти;
+# при постановке задания он просто перемещается в uploads/.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -1,14 +1,185 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import List, Union
-from sentence_transformers import SentenceTransformer
+from typing import List, Optional, Tuple, Union
+from sentence_transformers import CrossEncoder, SentenceTransformer
 import asyncio
+import logging
+import struct
+import time
+from collections import deque
 
-model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Многоязычный cross-encoder для /rerank (русский поддерживается), ~120M параметров, CPU.
+RERANK_MODEL_NAME = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+RERANK_MAX_LENGTH = 256
+
+# Максимальное число текстов в одном проходе модели и максимальное время,
+# которое первый запрос в очереди ждёт попутчиков перед запуском батча.
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 10
+METRICS_WINDOW = 1000
+
+# Бинарный формат ответа /embed: заголовок из двух uint32 little-endian
+# (число векторов, размерность), за ним матрица float32 little-endian по строкам.
+# Отдаётся, если клиент прислал этот тип в Accept, иначе — JSON.
+EMBED_BINARY_MEDIA_TYPE = "application/x-embeddings-f32"
+EMBED_BINARY_HEADER = struct.Struct("<II")
+
+model = SentenceTransformer(MODEL_NAME, device="cpu")
+reranker = CrossEncoder(RERANK_MODEL_NAME, max_length=RERANK_MAX_LENGTH, device="cpu")
 
 app = FastAPI(title="Embedding API")
 
 
+class MicroBatcher:
+    """
+    Склеивает одновременные запросы к модели в один вызов encode_fn
+    (model.encode для эмбеддингов, reranker.predict для /rerank).
+
+    Каждый запрос кладёт в очередь свой список входов и future; фоновая задача
+    набирает батч до max_batch_size входов (или пока не истечёт max_wait_ms с
+    момента прихода первого запроса), обрабатывает его одним проходом и раздаёт
+    каждому вызывающему его срез результата.
+    """
+
+    def __init__(self, encode_fn, empty_result, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.empty_result = empty_result
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker_task = None
+        self._batch_sizes = deque(maxlen=METRICS_WINDOW)
+        self._queue_waits = deque(maxlen=METRICS_WINDOW)
+        self._batches_total = 0
+        self._texts_total = 0
+
+    def start(self):
+        if self._worker_task is None or self._worker_task.done():
+            self._worker_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker_task and not self._worker_task.done():
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+        self._worker_task = None
+
+    async def submit(self, texts: list) -> np.ndarray:
+        if not texts:
+            return self.empty_result()
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """Набирает очередной батч: блокируется до первого запроса, затем ждёт не дольше max_wait."""
+        first = await self._queue.get()
+        batch = [first]
+        size = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            texts = [text for item_texts, _, _ in batch for text in item_texts]
+
+            self._batches_total += 1
+            self._texts_total += len(texts)
+            self._batch_sizes.append(len(texts))
+            for _, _, enqueued in batch:
+                self._queue_waits.append(started - enqueued)
+
+            try:
+                embeddings = await asyncio.to_thread(self.encode_fn, texts)
+            except Exception as e:
+                log.exception(f"Batch encode of {len(texts)} texts failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for item_texts, future, _ in batch:
+                end = offset + len(item_texts)
+                if not future.done():
+                    future.set_result(embeddings[offset:end])
+                offset = end
+
+    def metrics(self) -> dict:
+        sizes = np.array(self._batch_sizes, dtype=np.float64)
+        waits_ms = np.array(self._queue_waits, dtype=np.float64) * 1000
+
+        def summary(values):
+            if not len(values):
+                return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            return {
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches_total": self._batches_total,
+            "texts_total": self._texts_total,
+            "queue_depth": self._queue.qsize(),
+            "batch_size": summary(sizes),
+            "queue_wait_ms": summary(waits_ms),
+        }
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    return model.encode(texts, convert_to_numpy=True, batch_size=MAX_BATCH_SIZE)
+
+
+def score_pairs(pairs: List[Tuple[str, str]]) -> np.ndarray:
+    return np.asarray(reranker.predict(pairs, batch_size=MAX_BATCH_SIZE, show_progress_bar=False), dtype=np.float32)
+
+
+embed_batcher = MicroBatcher(
+    encode_texts,
+    empty_result=lambda: np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32),
+)
+rerank_batcher = MicroBatcher(score_pairs, empty_result=lambda: np.zeros(0, dtype=np.float32))
+
+
+@app.on_event("startup")
+async def start_batcher():
+    embed_batcher.start()
+    rerank_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await embed_batcher.stop()
+    await rerank_batcher.stop()
+
+
 class EmbedRequest(BaseModel):
     texts: Union[str, List[str]]
 
@@ -17,10 +188,53 @@ class EmbedResponse(BaseModel):
     embeddings: List[List[float]]
 
 
+def encode_binary(embeddings: np.ndarray) -> bytes:
+    matrix = np.ascontiguousarray(embeddings, dtype="<f4")
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    rows, dim = matrix.shape
+    return EMBED_BINARY_HEADER.pack(rows, dim) + matrix.tobytes()
+
+
 @app.post("/embed", response_model=EmbedResponse)
-async def get_embeddings(request: EmbedRequest):
+async def get_embeddings(request: EmbedRequest, http_request: Request):
     texts = [request.texts] if isinstance(request.texts, str) else request.texts
 
-    embeddings = await asyncio.to_thread(model.encode, texts, convert_to_numpy=True)
+    embeddings = await embed_batcher.submit(texts)
 
+    if EMBED_BINARY_MEDIA_TYPE in http_request.headers.get("accept", ""):
+        return Response(content=encode_binary(embeddings), media_type=EMBED_BINARY_MEDIA_TYPE)
     return {"embeddings": embeddings.tolist()}
+
+
+class RerankRequest(BaseModel):
+    query: str
+    passages: List[str]
+    top_n: Optional[int] = None
+
+
+class RerankResult(BaseModel):
+    index: int
+    score: float
+
+
+class RerankResponse(BaseModel):
+    results: List[RerankResult]
+
+
+@app.post("/rerank", response_model=RerankResponse)
+async def rerank(request: RerankRequest):
+    """
+    Оценивает релевантность пассажей запросу cross-encoder'ом и возвращает
+    индексы пассажей по убыванию score (не больше top_n).
+    """
+    scores = await rerank_batcher.submit([(request.query, passage) for passage in request.passages])
+    order = np.argsort(-scores, kind="stable")
+    if request.top_n is not None:
+        order = order[:request.top_n]
+    return {"results": [{"index": int(i), "score": float(scores[i])} for i in order]}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return {"embed": embed_batcher.metrics(), "rerank": rerank_batcher.metrics()}
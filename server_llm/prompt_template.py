@@ -0,0 +1,36 @@
+"""
+Chat template of the served model (T-lite is Qwen2.5-based and uses ChatML).
+
+The template is rendered in one place so that every request to the backend
+shares the same byte-exact prefix: system prompt first, then the user turn.
+Anything that varies per request must come after the stable parts, otherwise
+the backend's prefix (KV) cache cannot reuse earlier computation.
+"""
+
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+ASSISTANT_HEADER = f"{IM_START}assistant\n"
+
+
+def render_prompt(user_message: str, system_prompt: str | None = None) -> str:
+    """Renders a single-turn conversation ready for raw-completion endpoints."""
+    parts = []
+    if system_prompt:
+        parts.append(f"{IM_START}system\n{system_prompt}{IM_END}\n")
+    parts.append(f"{IM_START}user\n{user_message}{IM_END}\n")
+    parts.append(ASSISTANT_HEADER)
+    return "".join(parts)
+
+
+def extract_completion(text: str, prompt: str) -> str:
+    """
+    The vLLM /generate server returns the prompt followed by the generated text.
+    Strips the prompt instead of splitting on the word "assistant", which also
+    cut answers that happened to contain it.
+    """
+    if text.startswith(prompt):
+        return text[len(prompt):].strip()
+    position = text.rfind(ASSISTANT_HEADER)
+    if position != -1:
+        return text[position + len(ASSISTANT_HEADER):].strip()
+    return text.strip()
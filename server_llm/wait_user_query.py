@@ -1,9 +1,16 @@
+import argparse
+import asyncio
 import json
+import signal
+import aio_pika
+import httpx
 import pika
 import requests
 import logging
 import time
 
+from prompt_template import extract_completion, render_prompt
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -15,23 +22,192 @@ VLLM_MODEL_NAME = "t-tech/T-lite-it-1.0"
 
 MAX_TOKENS_TO_GENERATE = 1024
 
+# Generation profiles selected by the "profile" field of a task. Follow-up
+# suggestions are three short questions and do not need the full answer budget.
+DEFAULT_PROFILE = "default"
+GENERATION_PROFILES = {
+    "default": {"max_tokens": MAX_TOKENS_TO_GENERATE},
+    "suggestions": {"max_tokens": 160},
+    "summary": {"max_tokens": 256},
+}
+
+
+def generation_params(profile: str | None) -> dict:
+    if profile not in GENERATION_PROFILES:
+        if profile:
+            logger.warning(f"Unknown generation profile '{profile}', using '{DEFAULT_PROFILE}'.")
+        profile = DEFAULT_PROFILE
+    return dict(GENERATION_PROFILES[profile])
+
+
+# Prefix caching: extra fields sent with every generation request, e.g.
+# {"cache_prompt": True} for llama-server (vLLM enables prefix caching itself).
+LLM_PREFIX_CACHE_PARAMS = {}
+# Request field that receives the task's "cache_salt" (a session hint for
+# backends that isolate or pin cached prefixes); None drops the hint.
+LLM_CACHE_SALT_FIELD = None
+
+
+def build_llm_request(prompt_text: str, profile: str | None = DEFAULT_PROFILE, system_prompt: str | None = None,
+                      cache_salt: str | None = None, stream: bool = False) -> dict:
+    data = {
+        "prompt": render_prompt(prompt_text, system_prompt),
+        **generation_params(profile),
+        **LLM_PREFIX_CACHE_PARAMS,
+    }
+    if stream:
+        data["stream"] = True
+    if cache_salt and LLM_CACHE_SALT_FIELD:
+        data[LLM_CACHE_SALT_FIELD] = cache_salt
+    return data
+
 RABBITMQ_HOST = '195.161.62.198'
-TASK_QUEUE_NAME = 'llm_task_queue'
+# Priority queue shared with AsyncLlmRpcClient: interactive streams (8) are
+# delivered before suggestions (5) and batch work such as history summaries (1).
+TASK_QUEUE_NAME = 'llm_task_queue_prio'
+TASK_QUEUE_MAX_PRIORITY = 10
+TASK_QUEUE_ARGUMENTS = {'x-max-priority': TASK_QUEUE_MAX_PRIORITY}
+# Tasks carry an absolute unix-time deadline; once it has passed the client has
+# stopped waiting, so the task is acknowledged without calling the LLM.
+DEADLINE_HEADER = 'x-deadline'
+DEADLINE_GRACE_SEC = 1.0
+# Clients publish {"correlation_id": ...} to this fanout exchange when nobody reads
+# the answer any more; every worker gets it and the one generating it aborts.
+CANCEL_EXCHANGE_NAME = 'llm_cancel'
+# Cancelled ids are remembered this long, so a cancel that overtakes its task still applies.
+CANCEL_REMEMBER_SEC = 300
+# How often the sync worker polls its cancel queue while streaming.
+CANCEL_POLL_INTERVAL = 0.2
 
 MSG_TYPE_CHUNK = "chunk"
 MSG_TYPE_END = "end"
 MSG_TYPE_ERROR = "error"
 
+# Version 2 of the stream protocol: every chunk carries only the text added since
+# the previous chunk ("content"), a 1-based sequence number ("seq") and "v".
+# If the backend rewrites already-sent text, the chunk carries the full text
+# with "replace": true.
+STREAM_PROTOCOL_VERSION = 2
+
+# Coalescing of stream events: buffered text is published when STREAM_FLUSH_INTERVAL_MS
+# have passed since the previous publish or STREAM_FLUSH_BYTES have accumulated,
+# whichever comes first. The first chunk is always published immediately.
+STREAM_FLUSH_INTERVAL_MS = 50
+STREAM_FLUSH_BYTES = 512
+
+# Асинхронный режим: сколько задач воркер обрабатывает одновременно (prefetch),
+# параметры общего HTTP-пула к LLM и сколько ждать завершения задач при остановке.
+WORKER_CONCURRENCY = 16
+LLM_POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+LLM_SINGLE_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+LLM_STREAM_TIMEOUT = httpx.Timeout(180.0, connect=10.0)
+SHUTDOWN_DRAIN_TIMEOUT = 180
+
 
-def query_llm_single(prompt_text: str) -> str | None:
+class CancellationRegistry:
+    """
+    Correlation ids cancelled by clients, plus the GPU time spent on streams that
+    were abandoned mid-generation (from the LLM request to the abort).
+    """
+
+    def __init__(self):
+        self._cancelled = {}
+        self.streams_aborted = 0
+        self.wasted_gpu_seconds = 0.0
+
+    def add_from_message(self, body: bytes) -> None:
+        try:
+            correlation_id = json.loads(body)["correlation_id"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Malformed cancel message: {body[:100]}")
+            return
+        now = time.monotonic()
+        self._cancelled = {cid: at for cid, at in self._cancelled.items() if now - at < CANCEL_REMEMBER_SEC}
+        self._cancelled[correlation_id] = now
+        logger.info(f"Cancel received for {correlation_id}")
+
+    def is_cancelled(self, correlation_id: str | None) -> bool:
+        return correlation_id in self._cancelled
+
+    def record_abort(self, correlation_id: str, generation_seconds: float) -> None:
+        self.streams_aborted += 1
+        self.wasted_gpu_seconds += generation_seconds
+        logger.info(f"Stream {correlation_id} aborted after {generation_seconds:.1f}s of generation "
+                    f"(aborted streams: {self.streams_aborted}, "
+                    f"wasted GPU time: {self.wasted_gpu_seconds:.1f}s)")
+
+
+cancellations = CancellationRegistry()
+# Sync worker: (channel, queue name) of the cancel queue, polled with basic_get.
+_cancel_source = None
+
+
+def poll_cancellations() -> None:
+    if _cancel_source is None:
+        return
+    channel, queue_name = _cancel_source
+    while True:
+        method, _, body = channel.basic_get(queue=queue_name, auto_ack=True)
+        if method is None:
+            return
+        cancellations.add_from_message(body)
+
+
+class StreamDeltaEncoder:
+    """Turns the cumulative text of each LLM stream event into protocol v2 delta chunks."""
+
+    def __init__(self):
+        self.sent_text = ""
+        self.seq = 0
+
+    def encode(self, full_text: str) -> dict | None:
+        """Returns the next chunk message, or None if nothing new was generated."""
+        replace = not full_text.startswith(self.sent_text)
+        delta = full_text if replace else full_text[len(self.sent_text):]
+        if not delta and not replace:
+            return None
+        self.sent_text = full_text
+        self.seq += 1
+        message = {"type": MSG_TYPE_CHUNK, "content": delta, "seq": self.seq, "v": STREAM_PROTOCOL_VERSION}
+        if replace:
+            message["replace"] = True
+        return message
+
+
+class StreamCoalescer:
+    """Buffers cumulative LLM text and emits a delta chunk only when a flush is due."""
+
+    def __init__(self, flush_interval_ms: float = STREAM_FLUSH_INTERVAL_MS, flush_bytes: int = STREAM_FLUSH_BYTES):
+        self.encoder = StreamDeltaEncoder()
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.latest_text = None
+        self.last_flush = time.monotonic()
+
+    def push(self, full_text: str) -> dict | None:
+        self.latest_text = full_text
+        sent = self.encoder.sent_text
+        pending_bytes = len(full_text[len(sent):].encode()) if full_text.startswith(sent) else self.flush_bytes
+        if (self.encoder.seq == 0
+                or pending_bytes >= self.flush_bytes
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            return self.flush()
+        return None
+
+    def flush(self) -> dict | None:
+        if self.latest_text is None:
+            return None
+        message = self.encoder.encode(self.latest_text)
+        if message is not None:
+            self.last_flush = time.monotonic()
+        return message
+
+
+def query_llm_single(prompt_text: str, profile: str = DEFAULT_PROFILE, system_prompt: str | None = None,
+                     cache_salt: str | None = None) -> str | None:
     """Sends a prompt to the local LLM (OpenAI format) and returns the complete response."""
     headers = {"Content-Type": "application/json"}
-    formatted_prompt = f"<|im_start|>user\n{prompt_text}\n<|im_end|>\n<|im_start|>assistant\n"
-
-    data = {
-        "prompt": formatted_prompt,
-        "max_tokens": MAX_TOKENS_TO_GENERATE,
-    }
+    data = build_llm_request(prompt_text, profile, system_prompt, cache_salt)
 
     logger.info(f"Sending single request to LLM (OpenAI format): {prompt_text[:100]}...")
     try:
@@ -40,16 +216,15 @@ def query_llm_single(prompt_text: str) -> str | None:
         result = response.json()
         logger.debug(f"LLM Raw Single Response (OpenAI format): {result}")
 
-        llm_response = result['text'][0].split("assistant")[1]
-
-        return llm_response.strip()
+        return extract_completion(result['text'][0], data["prompt"])
 
     except Exception as e:
         logger.error(f"Unexpected error during single LLM query: {e}", exc_info=True)
         return "Unexpected error during LLM query."
 
 
-def stream_llm_response(ch, method, props, prompt_text: str):
+def stream_llm_response(ch, method, props, prompt_text: str, profile: str = DEFAULT_PROFILE,
+                        system_prompt: str | None = None, cache_salt: str | None = None):
     """
     Sends a prompt to the LLM (OpenAI format) requesting a stream and sends chunks back
     via RabbitMQ.
@@ -67,30 +242,36 @@ def stream_llm_response(ch, method, props, prompt_text: str):
             logger.error(f"Failed to ACK message {correlation_id} (no reply queue): {ack_e}")
         return
 
-    formatted_prompt = f"<|im_start|>user\n{prompt_text}\n<|im_end|>\n<|im_start|>assistant\n"
-
     headers = {"Content-Type": "application/json"}
-    data = {
-        "prompt": formatted_prompt,
-        "max_tokens": MAX_TOKENS_TO_GENERATE,
-        "stream": True
-    }
+    data = build_llm_request(prompt_text, profile, system_prompt, cache_salt, stream=True)
 
     logger.info(f"Sending stream request to LLM (OpenAI format) (ID: {correlation_id}): {prompt_text[:100]}...")
 
     success = True
+    cancelled = False
     stream_client = None
     try:
+        started = time.monotonic()
+        last_poll = started
         response = requests.post(LLM_API_URL, headers=headers, json=data, stream=True, timeout=180)
 
         event_count = 0
+        coalescer = StreamCoalescer()
         for chunk in response.iter_lines():
             event_count += 1
+            if time.monotonic() - last_poll >= CANCEL_POLL_INTERVAL:
+                last_poll = time.monotonic()
+                poll_cancellations()
+            if cancellations.is_cancelled(correlation_id):
+                cancelled = True
+                response.close()
+                cancellations.record_abort(correlation_id, time.monotonic() - started)
+                break
             logger.debug(f"--- Stream Event {event_count} for {correlation_id} ---")
             logger.debug(f"Event Data Raw: {chunk[:500]}")
 
             json_resp = json.loads(chunk)
-            llm_response = json_resp['text'][0].split("assistant")[1].strip()
+            llm_response = extract_completion(json_resp['text'][0], data["prompt"])
 
             if chunk.strip() == '[DONE]':
                 logger.info(f"Received [DONE] marker for stream {correlation_id}")
@@ -101,7 +282,10 @@ def stream_llm_response(ch, method, props, prompt_text: str):
                 continue
 
             try:
-                payload = json.dumps({"type": MSG_TYPE_CHUNK, "content": llm_response})
+                chunk_message = coalescer.push(llm_response)
+                if chunk_message is None:
+                    continue
+                payload = json.dumps(chunk_message)
 
                 ch.basic_publish(
                     exchange='',
@@ -120,6 +304,15 @@ def stream_llm_response(ch, method, props, prompt_text: str):
                              exc_info=True)
                 continue
 
+        chunk_message = coalescer.flush()
+        if chunk_message is not None and not cancelled:
+            ch.basic_publish(
+                exchange='',
+                routing_key=reply_to_queue,
+                properties=pika.BasicProperties(correlation_id=correlation_id, content_type='application/json'),
+                body=json.dumps(chunk_message)
+            )
+
     except requests.exceptions.Timeout:
         logger.error(f"Timeout connecting to LLM API (stream) for {correlation_id}: {LLM_API_URL}")
         payload = json.dumps({"type": MSG_TYPE_ERROR, "content": "Timeout connecting to LLM."})
@@ -155,7 +348,9 @@ def stream_llm_response(ch, method, props, prompt_text: str):
             except Exception as close_e:
                 logger.warning(f"Error closing SSEClient connection for {correlation_id}: {close_e}")
 
-        if success:
+        if cancelled:
+            logger.info(f"Stream {correlation_id} cancelled by client, not sending END marker.")
+        elif success:
             try:
                 logger.info(f"Sending END marker for stream {correlation_id}")
                 payload = json.dumps({"type": MSG_TYPE_END})
@@ -178,6 +373,16 @@ def stream_llm_response(ch, method, props, prompt_text: str):
             logger.error(f"Failed to ACK stream message {correlation_id}: {e}")
 
 
+def deadline_passed(headers: dict | None) -> bool:
+    deadline = (headers or {}).get(DEADLINE_HEADER)
+    if deadline is None:
+        return False
+    try:
+        return float(deadline) + DEADLINE_GRACE_SEC < time.time()
+    except (TypeError, ValueError):
+        return False
+
+
 def on_request(ch, method, props, body):
     """ Callback function called when receiving a message from TASK_QUEUE_NAME """
     correlation_id = props.correlation_id
@@ -186,17 +391,29 @@ def on_request(ch, method, props, body):
     print(
         f"\n [x] Received request (ID: {correlation_id}) from '{reply_to_queue if reply_to_queue else 'No Reply Queue!'}'.")
 
+    poll_cancellations()
+    if deadline_passed(props.headers) or cancellations.is_cancelled(correlation_id):
+        logger.warning(f"Request {correlation_id} expired or cancelled before processing, dropping it.")
+        try:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        except Exception as ack_e:
+            logger.error(f"Failed to ACK expired message {correlation_id}: {ack_e}")
+        return
+
     try:
         data = json.loads(body)
         user_message = data.get('message', '')
+        profile = data.get('profile', DEFAULT_PROFILE)
+        system_prompt = data.get('system')
+        cache_salt = data.get('cache_salt')
         is_stream_request = data.get('stream', False)
 
         if is_stream_request:
             logger.info(f"Processing STREAM request {correlation_id}...")
-            stream_llm_response(ch, method, props, user_message)
+            stream_llm_response(ch, method, props, user_message, profile, system_prompt, cache_salt)
         else:
             logger.info(f"Processing SINGLE request {correlation_id}...")
-            response_text = query_llm_single(user_message)
+            response_text = query_llm_single(user_message, profile, system_prompt, cache_salt)
             response_payload_data = {"llm_response": response_text}
             response_payload = json.dumps(response_payload_data)
 
@@ -253,6 +470,7 @@ def on_request(ch, method, props, body):
 
 def start_worker():
     """Connects to RabbitMQ and starts consuming messages."""
+    global _cancel_source
     connection = None
     while True:
         try:
@@ -267,11 +485,18 @@ def start_worker():
             logger.info("Connection successful.")
             channel = connection.channel()
 
-            channel.queue_declare(queue=TASK_QUEUE_NAME, durable=True)
+            channel.queue_declare(queue=TASK_QUEUE_NAME, durable=True, arguments=TASK_QUEUE_ARGUMENTS)
             logger.info(f" [*] Queue '{TASK_QUEUE_NAME}' declared/ready.")
 
             channel.basic_qos(prefetch_count=1)
 
+            # Cancels are read on a separate channel between stream events.
+            cancel_channel = connection.channel()
+            cancel_channel.exchange_declare(exchange=CANCEL_EXCHANGE_NAME, exchange_type='fanout')
+            cancel_queue = cancel_channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+            cancel_channel.queue_bind(queue=cancel_queue, exchange=CANCEL_EXCHANGE_NAME)
+            _cancel_source = (cancel_channel, cancel_queue)
+
             channel.basic_consume(queue=TASK_QUEUE_NAME, on_message_callback=on_request, auto_ack=False)
 
             logger.info(" [*] Waiting for messages. To exit press CTRL+C")
@@ -305,5 +530,243 @@ def start_worker():
             time.sleep(10)
 
 
+async def query_llm_single_async(http: httpx.AsyncClient, prompt_text: str, profile: str = DEFAULT_PROFILE,
+                                 system_prompt: str | None = None, cache_salt: str | None = None) -> str:
+    """Async counterpart of query_llm_single using the shared HTTP pool."""
+    data = build_llm_request(prompt_text, profile, system_prompt, cache_salt)
+
+    logger.info(f"Sending single request to LLM (async): {prompt_text[:100]}...")
+    try:
+        response = await http.post(LLM_API_URL, json=data, timeout=LLM_SINGLE_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+        logger.debug(f"LLM Raw Single Response (async): {result}")
+        return extract_completion(result['text'][0], data["prompt"])
+    except Exception as e:
+        logger.error(f"Unexpected error during async single LLM query: {e}", exc_info=True)
+        return "Unexpected error during LLM query."
+
+
+async def publish_reply(channel: aio_pika.abc.AbstractChannel, reply_to_queue: str, correlation_id: str,
+                        payload: dict) -> None:
+    await channel.default_exchange.publish(
+        aio_pika.Message(
+            body=json.dumps(payload).encode(),
+            correlation_id=correlation_id,
+            content_type='application/json',
+        ),
+        routing_key=reply_to_queue,
+    )
+
+
+async def stream_llm_response_async(channel: aio_pika.abc.AbstractChannel, http: httpx.AsyncClient,
+                                    correlation_id: str, reply_to_queue: str, prompt_text: str,
+                                    profile: str = DEFAULT_PROFILE, system_prompt: str | None = None,
+                                    cache_salt: str | None = None) -> None:
+    """
+    Streams an LLM answer back via RabbitMQ without blocking other in-flight tasks.
+    Errors are reported to the client as MSG_TYPE_ERROR; END is sent only on success.
+    A cancel from the client closes the upstream HTTP stream, which makes the
+    backend abort the generation.
+    """
+    data = build_llm_request(prompt_text, profile, system_prompt, cache_salt, stream=True)
+
+    logger.info(f"Sending stream request to LLM (async) (ID: {correlation_id}): {prompt_text[:100]}...")
+    started = time.monotonic()
+    cancelled = False
+    try:
+        async with http.stream("POST", LLM_API_URL, json=data, timeout=LLM_STREAM_TIMEOUT) as response:
+            response.raise_for_status()
+            event_count = 0
+            coalescer = StreamCoalescer()
+            async for chunk in response.aiter_lines():
+                if cancellations.is_cancelled(correlation_id):
+                    cancelled = True
+                    break
+                if not chunk.strip():
+                    continue
+                if chunk.strip() == '[DONE]':
+                    logger.info(f"Received [DONE] marker for stream {correlation_id}")
+                    break
+                event_count += 1
+                try:
+                    json_resp = json.loads(chunk)
+                except json.JSONDecodeError:
+                    logger.warning(f"Non-JSON data in stream for {correlation_id}: {chunk[:100]}")
+                    continue
+                llm_response = extract_completion(json_resp['text'][0], data["prompt"])
+                chunk_message = coalescer.push(llm_response)
+                if chunk_message is not None:
+                    await publish_reply(channel, reply_to_queue, correlation_id, chunk_message)
+            if cancelled:
+                cancellations.record_abort(correlation_id, time.monotonic() - started)
+                return
+            chunk_message = coalescer.flush()
+            if chunk_message is not None:
+                await publish_reply(channel, reply_to_queue, correlation_id, chunk_message)
+            logger.debug(f"Stream {correlation_id} finished after {event_count} events")
+
+    except httpx.TimeoutException:
+        logger.error(f"Timeout talking to LLM API (stream) for {correlation_id}: {LLM_API_URL}")
+        await publish_reply(channel, reply_to_queue, correlation_id,
+                            {"type": MSG_TYPE_ERROR, "content": "Timeout connecting to LLM."})
+        return
+    except httpx.HTTPError as e:
+        logger.error(f"Error connecting to LLM API (stream) for {correlation_id}: {e}")
+        await publish_reply(channel, reply_to_queue, correlation_id,
+                            {"type": MSG_TYPE_ERROR, "content": f"Error connecting to LLM: {e}"})
+        return
+    except Exception as e:
+        logger.error(f"Unexpected error during LLM stream for {correlation_id}: {e}", exc_info=True)
+        await publish_reply(channel, reply_to_queue, correlation_id,
+                            {"type": MSG_TYPE_ERROR, "content": f"Worker error during stream: {e}"})
+        return
+
+    logger.info(f"Sending END marker for stream {correlation_id}")
+    await publish_reply(channel, reply_to_queue, correlation_id, {"type": MSG_TYPE_END})
+
+
+class AsyncWorker:
+    """
+    Asyncio consumer that keeps up to `concurrency` LLM generations in flight, so a
+    continuous-batching backend (vLLM) actually receives concurrent requests.
+    Each task is acknowledged only after it completes.
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.connection = None
+        self.channel = None
+        self.http = None
+        self._queue = None
+        self._consumer_tag = None
+        self._tasks = set()
+        self._stopping = asyncio.Event()
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        correlation_id = message.correlation_id
+        reply_to_queue = message.reply_to
+        print(f"\n [x] Received request (ID: {correlation_id}) from "
+              f"'{reply_to_queue if reply_to_queue else 'No Reply Queue!'}'.")
+        try:
+            data = json.loads(message.body)
+            user_message = data.get('message', '')
+            profile = data.get('profile', DEFAULT_PROFILE)
+            system_prompt = data.get('system')
+            cache_salt = data.get('cache_salt')
+
+            if not reply_to_queue:
+                logger.warning(f"No reply_to queue for request {correlation_id}. Result not sent.")
+            elif deadline_passed(message.headers) or cancellations.is_cancelled(correlation_id):
+                logger.warning(f"Request {correlation_id} expired or cancelled before processing, dropping it.")
+            elif data.get('stream', False):
+                logger.info(f"Processing STREAM request {correlation_id}...")
+                await stream_llm_response_async(self.channel, self.http, correlation_id, reply_to_queue,
+                                                user_message, profile, system_prompt, cache_salt)
+            else:
+                logger.info(f"Processing SINGLE request {correlation_id}...")
+                response_text = await query_llm_single_async(self.http, user_message, profile, system_prompt,
+                                                             cache_salt)
+                await publish_reply(self.channel, reply_to_queue, correlation_id, {"llm_response": response_text})
+                logger.info(f"Single response for {correlation_id} sent to {reply_to_queue}")
+
+        except json.JSONDecodeError:
+            logger.error(f" [!] Error decoding incoming JSON request for {correlation_id}")
+            if reply_to_queue and correlation_id:
+                error_payload = {"type": MSG_TYPE_ERROR, "content": "Invalid JSON format received by worker"}
+                try:
+                    await publish_reply(self.channel, reply_to_queue, correlation_id, error_payload)
+                except Exception as pub_e:
+                    logger.error(f"Failed to send JSON decode error reply for {correlation_id}: {pub_e}")
+        except asyncio.CancelledError:
+            logger.warning(f" [!] Task {correlation_id} cancelled before completion, requeueing.")
+            try:
+                await message.nack(requeue=True)
+            except Exception as nack_e:
+                logger.error(f"Failed to NACK message {correlation_id}: {nack_e}")
+            raise
+        except Exception as e:
+            logger.error(f" [!] Error during request processing for {correlation_id}: {e}", exc_info=True)
+            if reply_to_queue and correlation_id:
+                try:
+                    await publish_reply(self.channel, reply_to_queue, correlation_id,
+                                        {"type": MSG_TYPE_ERROR, "content": f"LLM worker processing error: {e}"})
+                except Exception as pub_e:
+                    logger.error(f"Failed to send processing error reply for {correlation_id}: {pub_e}")
+
+        try:
+            await message.ack()
+            logger.info(f"Message {correlation_id} acknowledged.")
+        except Exception as ack_e:
+            logger.error(f"Failed to ACK message {correlation_id}: {ack_e}")
+
+    async def _on_cancel(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        cancellations.add_from_message(message.body)
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        task = asyncio.create_task(self._handle(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def request_stop(self) -> None:
+        logger.info(" [*] Shutdown requested, draining in-flight tasks...")
+        self._stopping.set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except NotImplementedError:
+                pass
+
+        self.http = httpx.AsyncClient(limits=LLM_POOL_LIMITS, headers={"Content-Type": "application/json"})
+        logger.info(f"Connecting to RabbitMQ at {RABBITMQ_HOST} (async, concurrency={self.concurrency})...")
+        self.connection = await aio_pika.connect_robust(host=RABBITMQ_HOST, heartbeat=60)
+        try:
+            self.channel = await self.connection.channel()
+            await self.channel.set_qos(prefetch_count=self.concurrency)
+            self._queue = await self.channel.declare_queue(TASK_QUEUE_NAME, durable=True,
+                                                           arguments=TASK_QUEUE_ARGUMENTS)
+            logger.info(f" [*] Queue '{TASK_QUEUE_NAME}' declared/ready.")
+
+            cancel_exchange = await self.channel.declare_exchange(CANCEL_EXCHANGE_NAME, aio_pika.ExchangeType.FANOUT)
+            cancel_queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+            await cancel_queue.bind(cancel_exchange)
+            await cancel_queue.consume(self._on_cancel, no_ack=True)
+
+            self._consumer_tag = await self._queue.consume(self._on_message, no_ack=False)
+            logger.info(" [*] Waiting for messages. To exit press CTRL+C")
+            await self._stopping.wait()
+
+            await self._queue.cancel(self._consumer_tag)
+            if self._tasks:
+                logger.info(f" [*] Waiting for {len(self._tasks)} in-flight task(s) to finish...")
+                done, pending = await asyncio.wait(self._tasks, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    logger.warning(f" [!] {len(pending)} task(s) cancelled after drain timeout; "
+                                   f"they will be redelivered.")
+        finally:
+            await self.http.aclose()
+            await self.connection.close()
+            logger.info(" [*] Async worker stopped.")
+
+
+def start_async_worker(concurrency: int = WORKER_CONCURRENCY):
+    asyncio.run(AsyncWorker(concurrency).run())
+
+
 if __name__ == '__main__':
-    start_worker()
+    parser = argparse.ArgumentParser(description="LLM worker consuming tasks from RabbitMQ.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run the asyncio worker with several concurrent generations.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY,
+                        help="Number of in-flight tasks in async mode.")
+    args = parser.parse_args()
+
+    if args.use_async:
+        start_async_worker(args.concurrency)
+    else:
+        start_worker()